@@ -0,0 +1,220 @@
+import os
+import time
+import logging
+import argparse
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Firestore rejects batches with more than 500 writes
+MAX_BATCH_SIZE = 500
+
+
+def audit_institute(user_data, email):
+    """
+    The institute key an audit entry carries: the name institute admins
+    filter on (physios hold it as ``institute``, admins as ``institute_name``).
+    """
+    if user_data.get('is_admin') == 1:
+        return user_data.get('institute_name') or email
+    return user_data.get('institute')
+
+
+class AuditLogWriter:
+    """
+    Queues audit entries in memory and writes them to Firestore in batches
+    from a background thread, so requests never wait on the audit write.
+
+    A batch is flushed when ``batch_size`` entries are waiting or
+    ``flush_interval`` seconds have passed. Failed batches go back to the
+    front of the queue. When the queue reaches ``max_queue`` the caller
+    flushes synchronously instead, so entries are never dropped.
+    """
+
+    def __init__(self, db, collection='audit_logs', batch_size=MAX_BATCH_SIZE,
+                 flush_interval=2.0, max_queue=10000):
+        self.db = db
+        self.collection = collection
+        self.batch_size = min(batch_size, MAX_BATCH_SIZE)
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._closed = False
+
+        self.flushed = 0
+        self.flush_failures = 0
+        self._last_failure = float('-inf')
+        self.flush_count = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self._total_flush_ms = 0.0
+
+    def log(self, entry):
+        with self._cond:
+            self._queue.append(entry)
+            depth = len(self._queue)
+            closed = self._closed
+            if not closed:
+                self._ensure_thread()
+                if depth >= self.batch_size:
+                    self._cond.notify()
+        if closed:
+            # no flusher runs after close(), so write it now
+            try:
+                self.flush()
+            except Exception:
+                logger.error(f"Audit log entry written during shutdown was not saved: {entry}")
+            return
+        # while Firestore is failing, leave retries to the flusher's backoff
+        if depth >= self.max_queue and time.monotonic() - self._last_failure > self.flush_interval:
+            logger.warning(f"Audit queue at {depth} entries; flushing in request")
+            try:
+                self.flush()
+            except Exception:
+                # already logged and re-queued; the request itself must not fail
+                pass
+
+    def _ensure_thread(self):
+        # gunicorn forks after import, so each worker starts its own flusher
+        if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='audit-log-writer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._closed and len(self._queue) < self.batch_size:
+                    self._cond.wait(self.flush_interval)
+                if self._closed:
+                    return
+            try:
+                self.flush()
+            except Exception:
+                # already logged and re-queued; back off before retrying
+                time.sleep(self.flush_interval)
+
+    def _flush_batch(self):
+        with self._cond:
+            entries = [self._queue.popleft()
+                       for _ in range(min(self.batch_size, len(self._queue)))]
+        if not entries:
+            return 0
+
+        started = time.perf_counter()
+        try:
+            batch = self.db.batch()
+            coll = self.db.collection(self.collection)
+            for entry in entries:
+                batch.set(coll.document(), entry)
+            batch.commit()
+        except Exception as e:
+            with self._cond:
+                self._queue.extendleft(reversed(entries))
+            self.flush_failures += 1
+            self._last_failure = time.monotonic()
+            logger.error(f"Audit log flush of {len(entries)} entries failed; re-queued: {e}",
+                         exc_info=True)
+            raise
+
+        elapsed = (time.perf_counter() - started) * 1000
+        self.flushed += len(entries)
+        self.flush_count += 1
+        self.last_flush_ms = elapsed
+        self.max_flush_ms = max(self.max_flush_ms, elapsed)
+        self._total_flush_ms += elapsed
+        return len(entries)
+
+    def flush(self):
+        """Write every queued entry. Raises if Firestore rejects a batch."""
+        with self._flush_lock:
+            while self._flush_batch():
+                pass
+
+    def close(self, retries=3):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        for attempt in range(retries):
+            try:
+                self.flush()
+                return
+            except Exception:
+                time.sleep(0.5 * (attempt + 1))
+        # last resort at shutdown: leave the entries in the log rather than lose them
+        for entry in self._queue:
+            logger.error(f"Unwritten audit log entry at shutdown: {entry}")
+
+    def metrics(self):
+        return {
+            'queue_depth': len(self._queue),
+            'flushed': self.flushed,
+            'flush_count': self.flush_count,
+            'flush_failures': self.flush_failures,
+            'last_flush_ms': round(self.last_flush_ms, 1),
+            'max_flush_ms': round(self.max_flush_ms, 1),
+            'avg_flush_ms': round(self._total_flush_ms / self.flush_count, 1) if self.flush_count else 0.0
+        }
+
+
+def backfill_institutes(db, auth, page_size=400):
+    """
+    Stamp ``institute`` onto audit entries that lack it or carry the wrong
+    key. Users are stored by email, entries by Firebase uid, so the uids are
+    looked up in Firebase Auth.
+    """
+    institutes = {}
+    for doc in db.collection('users').stream():
+        institute = audit_institute(doc.to_dict(), doc.id)
+        if not institute:
+            continue
+        try:
+            institutes[auth.get_user_by_email(doc.id).uid] = institute
+        except Exception as e:
+            logger.warning(f"No Firebase user for {doc.id}; skipped: {e}")
+
+    updated = scanned = 0
+    query = db.collection('audit_logs').order_by('__name__').limit(page_size)
+    last = None
+    while True:
+        page = list((query.start_after(last) if last else query).stream())
+        if not page:
+            break
+        batch = db.batch()
+        writes = 0
+        for doc in page:
+            scanned += 1
+            entry = doc.to_dict()
+            institute = institutes.get(entry.get('user_id'))
+            if institute and entry.get('institute') != institute:
+                batch.update(doc.reference, {'institute': institute})
+                writes += 1
+        if writes:
+            batch.commit()
+            updated += writes
+        last = page[-1]
+        logger.info(f"Audit backfill: {scanned} entries scanned, {updated} updated")
+    return scanned, updated
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Audit log maintenance')
+    parser.add_argument('command', choices=['backfill'])
+    parser.add_argument('--page-size', type=int, default=400,
+                        help='entries per batch (at most 500)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    from clients import db, auth
+    scanned, updated = backfill_institutes(db, auth, min(args.page_size, MAX_BATCH_SIZE))
+    print(f"Scanned {scanned} audit entries, {updated} updated")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""
+Throughput of report PDF rendering: in-request (inline) rendering from
+several threads against the warm process pool at increasing sizes.
+
+    python bench_pdf.py
+    python bench_pdf.py --reports 200 --threads 8 --chars 2000
+    python bench_pdf.py --processes 1,2,4
+
+Inline threads share one GIL, so their PDFs/sec stays near the
+single-thread figure; the pool should scale with the number of processes
+up to the core count. Every mode renders the same patient_report.html.
+
+Recorded with --reports 40 --threads 4 --processes 1,2,4 on a 1-vCPU
+host, Python 3.11, xhtml2pdf 0.2.17, reportlab 4.4; 4 KB reports:
+
+    mode                  PDFs/sec   speedup
+    inline, 1 thread          47.5      1.0x
+    inline, 4 threads         45.6      1.0x
+    process, 1 worker         45.3      1.0x
+    process, 2 workers        46.4      1.0x
+    process, 4 workers        45.5      1.0x
+
+With one core every mode renders one PDF at a time, so the pool only
+moves the work off the request thread; the 2- and 4-worker rows show the
+oversubscription cost, not scaling. Multi-core figures are still to be
+recorded on a host with the cores.
+"""
+import os
+import time
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from jinja2 import Environment, FileSystemLoader
+
+from jobs import JobQueue
+from pdf_renderer import render_pdf, warm_up
+
+TEMPLATES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+
+
+def report_html(chars):
+    env = Environment(loader=FileSystemLoader(TEMPLATES), autoescape=True)
+    env.globals.update(
+        url_for=lambda endpoint, **kw: f"/static/{kw['filename']}" if endpoint == 'static' else '#',
+        get_flashed_messages=lambda **kw: [])
+    text = ('Intermittent lumbar pain radiating to the left buttock, worse on sitting ' * 100)[:chars]
+    return env.get_template('patient_report.html').render(
+        patient={'name': 'Bench Patient', 'patient_id': '2025/01/01',
+                 'age_sex': '45/F', 'contact': '+91 98765 43210'},
+        subjective={'body_structure': text},
+        perspectives={'knowledge': text},
+        diagnosis={'likelihood': text},
+        goals={'patient_goal': text},
+        treatment={'treatment': text})
+
+
+def inline(html, reports, threads):
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for _ in pool.map(render_pdf, [html] * reports):
+            pass
+    return reports / (time.perf_counter() - started)
+
+
+def pooled(html, reports, processes):
+    with tempfile.TemporaryDirectory() as directory:
+        queue = JobQueue(directory, processes=processes, nice=0)
+        queue.warm()
+        # an untimed round, so every process has finished its initializer
+        for f in [queue.render(html) for _ in range(processes * 2)]:
+            f.result()
+        started = time.perf_counter()
+        for f in [queue.render(html) for _ in range(reports)]:
+            f.result()
+        rate = reports / (time.perf_counter() - started)
+        queue.close(wait=True)
+    return rate
+
+
+def pool_sizes(cores):
+    sizes, n = [], 1
+    while n < cores:
+        sizes.append(n)
+        n *= 2
+    return sizes + [cores]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--reports', type=int, default=60, help='PDFs rendered per mode')
+    parser.add_argument('--threads', type=int, default=8, help='request threads for inline rendering')
+    parser.add_argument('--chars', type=int, default=1000, help='characters of free text per section')
+    parser.add_argument('--processes', help='comma-separated pool sizes (default: 1, 2, 4, ... up to the core count)')
+    args = parser.parse_args()
+
+    cores = os.cpu_count() or 1
+    html = report_html(args.chars)
+    warm_up()
+    size = len(render_pdf(html))
+    print(f"{args.reports} reports of ~{size // 1024} KB, {cores} cores")
+    print(f"{'mode':<22}{'PDFs/sec':>10}{'speedup':>10}")
+
+    baseline = inline(html, args.reports, 1)
+    print(f"{'inline, 1 thread':<22}{baseline:>10.1f}{1:>9.1f}x")
+    rate = inline(html, args.reports, args.threads)
+    print(f"{f'inline, {args.threads} threads':<22}{rate:>10.1f}{rate / baseline:>9.1f}x")
+    sizes = [int(n) for n in args.processes.split(',')] if args.processes else pool_sizes(cores)
+    for n in sizes:
+        rate = pooled(html, args.reports, n)
+        label = f"process, {n} worker{'s' if n > 1 else ''}"
+        print(f"{label:<22}{rate:>10.1f}{rate / baseline:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+"""
+Micro-benchmark of prompt construction: the memoized builders in prompts_py
+against the previous string-joining versions, on the request pattern of one
+page (every field of the stage asked about with the same patient context).
+
+    python bench_prompts.py
+    python bench_prompts.py --pages 20000 --fields-chars 400
+
+Each builder's output is checked against its legacy version first, so the
+numbers compare identical prompts.
+"""
+import time
+import argparse
+
+from prompts_py import PROMPT_TEMPLATES, _render_lines, _label
+
+
+# ─── LEGACY BUILDERS (before memoization) ────
+def legacy_perspectives_field(previous, inputs, field):
+    age_sex = previous.get('age_sex', '')
+    present = previous.get('present_history', '')
+    past = previous.get('past_history', '')
+    subj = previous.get('subjective', {})
+    perspectives = previous.get('perspectives', {})
+
+    prompt = (
+        "You are a physiotherapy clinical decision-support assistant. Exclude any identifiers.\n"
+        "Patient summary:\n"
+        f"- Age/Sex: {age_sex}\n"
+        f"- Present history: {present}\n"
+        f"- Past history: {past}\n\n"
+        "Subjective findings:\n" +
+        "\n".join(f"- {k.replace('_', ' ').title()}: {v}" for k, v in subj.items() if v) +
+        "\n\nPatient perspectives recorded so far:\n" +
+        "\n".join(f"- {k.replace('_', ' ').title()}: {v}" for k, v in perspectives.items() if k != field and v) +
+        f"\n\nFor **{field.replace('_', ' ').title()}**, suggest **2–3 concise, open-ended questions** a physiotherapist can ask to explore this area deeper. "
+        "Format as a numbered list."
+    )
+    return prompt
+
+
+def legacy_initial_plan(prev, field, selection):
+    prompt = (
+        "You are a PHI-safe clinical assessment assistant. Use WHO-ICF and physiotherapy best practices.\n\n"
+        "Patient context:\n"
+        f"- Age/Sex: {prev.get('age_sex', '')}\n"
+        f"- Present history: {prev.get('present_history', '')}\n"
+        f"- Past history: {prev.get('past_history', '')}\n\n"
+        "Subjective findings:\n" +
+        "\n".join(f"- {k.replace('_', ' ').title()}: {v}" for k, v in prev.get('subjective', {}).items() if v) +
+        "\n\nPerspectives:\n" +
+        "\n".join(f"- {k.replace('_', ' ').title()}: {v}" for k, v in prev.get('perspectives', {}).items() if v) +
+        f"\n\nThe therapist marked **{field.replace('_', ' ').title()}** as **{selection}**. "
+        "Interpret **Mandatory assessment** as essential tests, **Assessment with precaution** as tests requiring caution, "
+        "and **Absolutely Contraindicated** as tests to avoid. "
+        "List **2-4** specific tests or maneuvers matching this category as a bullet list."
+    )
+    return prompt
+
+
+def legacy_chronic_factors(prev, text_input, causes_selected):
+    causes_text = (
+        "\n".join(f"- {c}" for c in causes_selected) if causes_selected else "- None"
+    )
+
+    prompt = (
+        "You are a PHI-safe clinical questioning assistant. Integrate all prior patient data:\n"
+        f"- Age/Sex: {prev.get('age_sex', '')}\n"
+        f"- Present history: {prev.get('present_history', '')}\n"
+        f"- Past history: {prev.get('past_history', '')}\n\n"
+        "Subjective findings:\n" +
+        "\n".join(f"- {k.replace('_', ' ').title()}: {v}" for k, v in prev.get('subjective', {}).items() if v) +
+        "\n\nPerspectives:\n" +
+        "\n".join(f"- {k.replace('_', ' ').title()}: {v}" for k, v in prev.get('perspectives', {}).items() if v) +
+        "\n\nAssessment plan:\n" +
+        "\n".join(f"- {k.replace('_', ' ').title()}: {v.get('choice')}" for k, v in prev.get('assessments', {}).items() if v.get('choice')) +
+        "\n\nThe clinician indicated these maintenance causes:\n" + causes_text +
+        f"\n\nSpecific factors described: {text_input}\n\n"
+        "What 3-5 directed, open-ended questions should the physiotherapist ask to clarify these chronic contributing factors?"
+    )
+    return prompt
+
+
+# ─── WORKLOAD ────────────────────────────────
+SUBJECTIVE = ('body_structure', 'body_function', 'activity_performance',
+              'activity_capacity', 'contextual_environmental', 'contextual_personal')
+PERSPECTIVES = ('knowledge', 'attribution', 'expectation', 'consequences_awareness',
+                'locus_of_control', 'affective_aspect')
+ASSESSMENTS = ('active_movements', 'passive_movements', 'passive_over_pressure',
+               'resisted_movements', 'combined_movements', 'special_tests',
+               'neuro_dynamic_examination')
+
+
+def make_context(chars):
+    text = ('Intermittent lumbar pain radiating to the left buttock, worse on sitting ' * 10)[:chars]
+    return {
+        'age_sex': '45/F',
+        'present_history': text,
+        'past_history': text,
+        'subjective': {f: text for f in SUBJECTIVE},
+        'perspectives': {f: 'Fair' for f in PERSPECTIVES},
+        'assessments': {f: {'choice': 'Mandatory assessment', 'details': text} for f in ASSESSMENTS},
+    }
+
+
+def cases(prev):
+    """(name, legacy builder, new builder, per-page calls) for one page view each."""
+    return [
+        ('perspectives_field', legacy_perspectives_field, PROMPT_TEMPLATES['perspectives_field'],
+         [(prev, {}, f) for f in PERSPECTIVES]),
+        ('initial_plan', legacy_initial_plan, PROMPT_TEMPLATES['initial_plan'],
+         [(prev, f, 'Mandatory assessment') for f in ASSESSMENTS]),
+        ('chronic_factors', legacy_chronic_factors, PROMPT_TEMPLATES['chronic_factors'],
+         [(prev, 'Desk job, poor sleep', ['Poor posture', 'Stress'])]),
+    ]
+
+
+def bench(fn, calls, pages):
+    started = time.perf_counter()
+    for _ in range(pages):
+        for args in calls:
+            fn(*args)
+    return (time.perf_counter() - started) / (pages * len(calls))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=5000, help='page views per builder')
+    parser.add_argument('--fields-chars', type=int, default=200, help='characters of free text per field')
+    args = parser.parse_args()
+
+    prev = make_context(args.fields_chars)
+    print(f"{args.pages} page views, {args.fields_chars} chars per field")
+    print(f"{'builder':<22}{'legacy us':>12}{'memoized us':>14}{'speedup':>10}")
+    for name, legacy, new, calls in cases(prev):
+        for call in calls:
+            assert legacy(*call) == new(*call), f"{name} output differs from the legacy builder"
+        legacy_us = bench(legacy, calls, args.pages) * 1e6
+        _render_lines.cache_clear()
+        _label.cache_clear()
+        new_us = bench(new, calls, args.pages) * 1e6
+        print(f"{name:<22}{legacy_us:>12.2f}{new_us:>14.2f}{legacy_us / new_us:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
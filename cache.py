@@ -0,0 +1,183 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """In-process LRU cache whose entries expire after ``ttl`` seconds."""
+
+    def __init__(self, maxsize=1024, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SQLiteCache:
+    """On-disk cache shared by every gunicorn worker on the same host."""
+
+    def __init__(self, path, ttl=3600, maxsize=10000, purge_every=100):
+        self.path = path
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.purge_every = purge_every
+        self._local = threading.local()
+        self._writes = 0
+        self._lock = threading.Lock()
+
+    def _conn(self):
+        # one connection per thread and per process, opened after fork
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS cache ('
+                'key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)'
+            )
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        row = self._conn().execute(
+            'SELECT value, expires FROM cache WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        value, expires = row
+        if expires < time.time():
+            self.delete(key)
+            return None
+        return json.loads(value)
+
+    def set(self, key, value):
+        self._conn().execute(
+            'INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)',
+            (key, json.dumps(value), time.time() + self.ttl)
+        )
+        with self._lock:
+            self._writes += 1
+            purge = self._writes % self.purge_every == 0
+        if purge:
+            self.purge()
+
+    def purge(self):
+        """Delete expired rows, then the soonest-expiring ones beyond ``maxsize``."""
+        conn = self._conn()
+        conn.execute('DELETE FROM cache WHERE expires < ?', (time.time(),))
+        excess = conn.execute('SELECT COUNT(*) FROM cache').fetchone()[0] - self.maxsize
+        if excess > 0:
+            conn.execute(
+                'DELETE FROM cache WHERE key IN '
+                '(SELECT key FROM cache ORDER BY expires LIMIT ?)', (excess,)
+            )
+
+    def delete(self, key):
+        self._conn().execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def clear(self):
+        self._conn().execute('DELETE FROM cache')
+
+    def __len__(self):
+        return self._conn().execute(
+            'SELECT COUNT(*) FROM cache WHERE expires >= ?', (time.time(),)
+        ).fetchone()[0]
+
+
+class ResponseCache:
+    """Caches AI completions keyed on the request parameters and prompt."""
+
+    def __init__(self, backend=None):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(model, temperature, max_tokens, prompt):
+        # trailing whitespace and line-ending differences must not split the cache
+        normalized = '\n'.join(line.rstrip() for line in prompt.strip().splitlines())
+        raw = json.dumps({
+            'model': model,
+            'temperature': round(float(temperature), 3),
+            'max_tokens': int(max_tokens),
+            'prompt': normalized
+        }, sort_keys=True)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        if self.backend is None:
+            return None
+        value = self.backend.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value):
+        if self.backend is not None:
+            self.backend.set(key, value)
+
+    def contains(self, key):
+        """Lookup that is not counted in the hit/miss stats."""
+        return self.backend is not None and self.backend.get(key) is not None
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'backend': type(self.backend).__name__ if self.backend else 'disabled',
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 3) if total else 0.0,
+            'size': len(self.backend) if self.backend is not None else 0
+        }
+
+
+def cache_from_env():
+    """Build the AI response cache from ``AI_CACHE_*`` environment variables."""
+    kind = os.environ.get('AI_CACHE_BACKEND', 'memory').lower()
+    ttl = int(os.environ.get('AI_CACHE_TTL', 3600))
+    size = int(os.environ.get('AI_CACHE_SIZE', 1024))
+    if kind == 'sqlite':
+        path = os.environ.get('AI_CACHE_PATH', 'ai_cache.sqlite3')
+        return ResponseCache(SQLiteCache(path, ttl=ttl, maxsize=size))
+    if kind in ('off', 'none', 'disabled'):
+        return ResponseCache(None)
+    return ResponseCache(LRUCache(maxsize=size, ttl=ttl))
@@ -0,0 +1,78 @@
+import os
+import json
+import logging
+import threading
+
+import firebase_admin
+from firebase_admin import credentials, firestore, auth as firebase_auth
+import openai
+
+logger = logging.getLogger(__name__)
+
+_firebase_lock = threading.Lock()
+
+
+def init_firebase():
+    """Initialize the Firebase Admin app once per process."""
+    with _firebase_lock:
+        try:
+            return firebase_admin.get_app()
+        except ValueError:
+            pass
+
+        # Render/CI pass the service account inline; otherwise use the file path
+        sa_json = os.environ.get('GOOGLE_APPLICATION_CREDENTIALS_JSON')
+        if sa_json:
+            sa = json.loads(sa_json)
+            cred = credentials.Certificate(sa)
+        else:
+            cred_path = os.getenv('GOOGLE_APPLICATION_CREDENTIALS')
+            if not cred_path:
+                raise RuntimeError("Missing GOOGLE_APPLICATION_CREDENTIALS")
+            with open(cred_path, 'r') as f:
+                sa = json.load(f)
+            cred = credentials.Certificate(cred_path)
+
+        app = firebase_admin.initialize_app(cred, {'projectId': sa.get('project_id')})
+        logger.info(f"Firebase Admin SDK initialized for project {sa.get('project_id')}")
+        return app
+
+
+class LazyClient:
+    """Stands in for a client and builds it on first attribute access."""
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._client = None
+        self._lock = threading.Lock()
+
+    def _get(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._factory()
+        return self._client
+
+    def __getattr__(self, name):
+        return getattr(self._get(), name)
+
+
+def _firestore_client():
+    init_firebase()
+    return firestore.client()
+
+
+def _firebase_auth():
+    init_firebase()
+    return firebase_auth
+
+
+def _openai_client():
+    # 429 backoff is handled by main.create_completion under the shared rate limiter
+    return openai.OpenAI(api_key=os.environ['OPENAI_API_KEY'], max_retries=0)
+
+
+# Nothing below touches the network or credentials until first use
+db = LazyClient(_firestore_client)
+auth = LazyClient(_firebase_auth)
+ai_client = LazyClient(_openai_client)
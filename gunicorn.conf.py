@@ -0,0 +1,30 @@
+import os
+
+# ─── SERVING MODES ───────────────────────────
+# gthread (default): a thread per in-flight request, bounded by `threads`.
+# gevent: cooperative greenlets; a worker holds up to `worker_connections`
+#   requests that are waiting on OpenAI or Firestore. Recommended for the
+#   /ai_suggestion/* traffic, which is almost entirely network wait.
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 1000))
+
+bind = os.environ.get('GUNICORN_BIND', f"0.0.0.0:{os.environ.get('PORT', 8000)}")
+# AI completions can take tens of seconds; don't let the arbiter kill them
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+graceful_timeout = 30
+keepalive = 5
+
+
+def post_worker_init(worker):
+    # gevent workers have monkey-patched the stdlib by now; gRPC (used by
+    # Firestore) needs its own hook or its calls block the whole worker.
+    if worker_class == 'gevent':
+        import grpc.experimental.gevent as grpc_gevent
+        grpc_gevent.init_gevent()
+
+    # start the PDF renderer's process pool now rather than in the first
+    # download (a no-op for PDF_RENDERER=inline)
+    from main import pdf_renderer
+    pdf_renderer.warm()
@@ -0,0 +1,74 @@
+import time
+import logging
+import threading
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+SIGN_IN_URL = 'https://identitytoolkit.googleapis.com/v1/accounts:signInWithPassword'
+
+
+class PasswordSignInClient:
+    """
+    Firebase email/password sign-in over one pooled keep-alive session, so
+    logins after the first skip DNS, TCP and TLS setup.
+    """
+
+    def __init__(self, api_key, connect_timeout=3.05, read_timeout=10,
+                 retries=2, backoff=0.3, pool_size=10):
+        self.api_key = api_key
+        self.timeout = (connect_timeout, read_timeout)
+
+        # sign-in has no side effects, so retrying the POST is safe
+        retry = Retry(total=retries, connect=retries, read=retries, status=retries,
+                      backoff_factor=backoff, status_forcelist=(500, 502, 503, 504),
+                      allowed_methods=frozenset(['POST']), raise_on_status=False)
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size,
+                                                   max_retries=retry))
+
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=1000)
+        self.count = 0
+        self.errors = 0
+
+    def sign_in(self, email, password):
+        """Return the Identity Toolkit response body (contains 'error' on bad credentials)."""
+        started = time.perf_counter()
+        failed = True
+        try:
+            r = self.session.post(
+                SIGN_IN_URL,
+                params={'key': self.api_key},
+                json={'email': email, 'password': password, 'returnSecureToken': True},
+                timeout=self.timeout
+            )
+            result = r.json()
+            failed = False
+            return result
+        finally:
+            elapsed = (time.perf_counter() - started) * 1000
+            with self._lock:
+                self.count += 1
+                self.errors += failed
+                self._latencies.append(elapsed)
+            logger.info(f"Firebase sign-in took {elapsed:.0f} ms")
+
+    def metrics(self):
+        with self._lock:
+            samples = sorted(self._latencies)
+
+        def pct(p):
+            return round(samples[min(len(samples) - 1, int(p * len(samples)))], 1) if samples else 0.0
+
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'p50_ms': pct(0.50),
+            'p95_ms': pct(0.95),
+            'max_ms': round(samples[-1], 1) if samples else 0.0
+        }
@@ -0,0 +1,195 @@
+"""
+Background jobs for PDF rendering and bulk report export.
+
+xhtml2pdf is CPU-bound pure Python, so the rendering itself runs in a
+process pool; each job's orchestration (Firestore reads, templating, ZIP
+writing) runs on a small thread pool in the web worker. Pool processes run
+at a lower scheduling priority (``nice``), so a large export only uses the
+CPU the interactive requests leave idle.
+
+Job state and results are files in ``directory`` (``<id>.json`` plus the
+result file), so a status poll or download landing on another gunicorn
+worker on the same host sees the same job. With PDF_RENDERER=process the
+report download renders in the same pool (see pdf_renderer.py).
+"""
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from pdf_renderer import init_worker, render_pdf
+
+logger = logging.getLogger(__name__)
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+
+class Job:
+    """Handle a running job uses to report progress and place its result."""
+
+    def __init__(self, queue, job_id):
+        self.queue = queue
+        self.id = job_id
+
+    def path(self, suffix):
+        return os.path.join(self.queue.directory, f"{self.id}.{suffix}")
+
+    def progress(self, done, total=None):
+        fields = {'done': done}
+        if total is not None:
+            fields['total'] = total
+        self.queue._update(self.id, **fields)
+
+    def note(self, **fields):
+        """Record extra fields (e.g. a failure count) in the job state."""
+        self.queue._update(self.id, **fields)
+
+
+class JobQueue:
+    def __init__(self, directory, processes=None, max_jobs=2, nice=10, ttl=86400):
+        self.directory = directory
+        self.processes = processes or max(1, (os.cpu_count() or 2) - 1)
+        self.nice = nice
+        self.ttl = ttl
+
+        self._runner = ThreadPoolExecutor(max_workers=max_jobs, thread_name_prefix='jobs')
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._lock = threading.Lock()
+
+    # ─── PROCESS POOL ────────────────────────────
+    @property
+    def pool(self):
+        # created on first use; spawn, since forking a threaded web worker
+        # can copy locks held by other threads
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = ProcessPoolExecutor(
+                        max_workers=self.processes,
+                        mp_context=multiprocessing.get_context('spawn'),
+                        initializer=init_worker,
+                        initargs=(self.nice,))
+        return self._pool
+
+    def warm(self):
+        """Start every pool process now rather than on the first render."""
+        return [self.pool.submit(os.getpid) for _ in range(self.processes)]
+
+    def render(self, html):
+        """Future of the PDF bytes for ``html``."""
+        return self.pool.submit(render_pdf, html)
+
+    # ─── JOB STATE ───────────────────────────────
+    def _state_path(self, job_id):
+        return os.path.join(self.directory, f"{job_id}.json")
+
+    def _write(self, state):
+        # created here rather than at construction, so importing main.py
+        # leaves the working directory alone
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._state_path(state['id'])
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp, path)
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            state = self.status(job_id) or {'id': job_id}
+            state.update(fields, updated=time.time())
+            self._write(state)
+        return state
+
+    def status(self, job_id):
+        """The job's state dict, or None for an unknown id."""
+        if not job_id.isalnum():
+            return None
+        try:
+            with open(self._state_path(job_id)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def result_path(self, job_id):
+        state = self.status(job_id)
+        if not state or state.get('state') != DONE:
+            return None
+        path = os.path.join(self.directory, state['result'])
+        return path if os.path.exists(path) else None
+
+    # ─── SUBMISSION ──────────────────────────────
+    def submit(self, kind, owner, fn, *args, filename=None):
+        """
+        Run ``fn(job, *args)`` in the background. It returns the name of its
+        result file (written via ``job.path``); ``filename`` is what the
+        download is offered as.
+        """
+        self.prune()
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self._write({
+            'id': job_id, 'kind': kind, 'owner': owner, 'state': QUEUED,
+            'done': 0, 'total': None, 'filename': filename,
+            'created': now, 'updated': now
+        })
+        self._runner.submit(self._run, job_id, fn, args)
+        return job_id
+
+    def _run(self, job_id, fn, args):
+        started = time.time()
+        self._update(job_id, state=RUNNING, started=started)
+        try:
+            result = fn(Job(self, job_id), *args)
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {e}", exc_info=True)
+            self._update(job_id, state=FAILED, error=str(e))
+            return
+        path = os.path.join(self.directory, result)
+        self._update(job_id, state=DONE, result=result, size=os.path.getsize(path),
+                     seconds=round(time.time() - started, 2))
+
+    def prune(self):
+        """Delete jobs, and their results, older than ``ttl``."""
+        cutoff = time.time() - self.ttl
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        for name in names:
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def close(self, wait=False):
+        self._runner.shutdown(wait=wait, cancel_futures=True)
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait, cancel_futures=True)
+
+
+def pool_size_per_worker():
+    """
+    JOB_PROCESSES is a budget for the whole host (default: cores - 1),
+    shared out between the WEB_CONCURRENCY gunicorn workers that each
+    hold a pool.
+    """
+    per_host = int(os.environ.get('JOB_PROCESSES', 0)) or max(1, (os.cpu_count() or 2) - 1)
+    workers = max(1, int(os.environ.get('WEB_CONCURRENCY', 1)))
+    return max(1, per_host // workers)
+
+
+def job_queue_from_env():
+    """Build the job queue from ``JOB_*`` environment variables."""
+    return JobQueue(
+        directory=os.environ.get('JOB_DIR', 'jobs'),
+        processes=pool_size_per_worker(),
+        max_jobs=int(os.environ.get('JOB_MAX_RUNNING', 2)),
+        nice=int(os.environ.get('JOB_NICE', 10)),
+        ttl=int(os.environ.get('JOB_TTL', 86400)))
@@ -0,0 +1,254 @@
+"""
+Chat-completion backends for the AI suggestion routes.
+
+    LLM_BACKEND=openai   OpenAI (or any compatible server via OPENAI_BASE_URL)
+    LLM_BACKEND=stub     deterministic local text, no network or API key
+
+The stub's timing comes from LLM_STUB_PROFILE (see STUB_PROFILES), with
+LLM_STUB_LATENCY and LLM_STUB_TOKENS_PER_SEC overriding either half.
+`serve_http_stub` puts the same stub behind an OpenAI-compatible HTTP
+endpoint, so the real SDK and connection handling can be exercised offline:
+
+    python llm_backends.py --port 8099 --profile gpt4
+    OPENAI_BASE_URL=http://127.0.0.1:8099/v1 OPENAI_API_KEY=stub gunicorn ...
+"""
+import os
+import re
+import json
+import time
+import uuid
+import random
+import hashlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class OpenAIBackend:
+    name = 'openai'
+
+    def __init__(self, client, model):
+        self.client = client
+        self.model = model
+
+    def complete(self, messages, temperature, max_tokens, timeout=None, **kwargs):
+        resp = self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            timeout=timeout,
+            **kwargs)
+        return resp.choices[0].message.content
+
+    def stream(self, messages, temperature, max_tokens, timeout=None, **kwargs):
+        # The request is sent here, not on first iteration, so connection
+        # errors surface to the caller's retry and circuit-breaker handling
+        chunks = self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            timeout=timeout,
+            stream=True,
+            **kwargs)
+        return (chunk.choices[0].delta.content for chunk in chunks
+                if chunk.choices and chunk.choices[0].delta.content)
+
+
+# (seconds before the first token, tokens per second; None = all at once)
+STUB_PROFILES = {
+    'instant': (0.0, None),
+    'fast': (0.2, 200.0),
+    'gpt4': (0.8, 30.0),
+    'slow': (3.0, 10.0),
+}
+
+_STUB_WORDS = (
+    'pain', 'onset', 'aggravating', 'easing', 'factors', 'morning', 'stiffness',
+    'range', 'movement', 'strength', 'sleep', 'work', 'activity', 'posture',
+    'load', 'history', 'function', 'goals', 'participation', 'symptoms',
+)
+
+
+class StubBackend:
+    """
+    Deterministic stand-in: the same prompt always yields the same text,
+    delivered after ``latency`` seconds at ``tokens_per_sec`` (one word per
+    token). A call whose simulated duration exceeds ``timeout`` raises
+    TimeoutError after ``timeout`` seconds, like a stalled upstream.
+
+    In JSON mode (``response_format={'type': 'json_object'}``) the last JSON
+    object in the prompt is taken as the reply template and every key is
+    filled with stub text.
+    """
+    name = 'stub'
+
+    def __init__(self, latency=0.0, tokens_per_sec=None, profile='custom'):
+        self.latency = latency
+        self.tokens_per_sec = tokens_per_sec
+        self.model = f"stub-{profile}"
+
+    def _words(self, messages, max_tokens):
+        prompt = messages[-1]['content'] if messages else ''
+        seed = hashlib.sha256(f"{self.model}\x00{prompt}".encode('utf-8')).digest()
+        rng = random.Random(seed)
+        count = min(max_tokens, 48)
+        words = []
+        for i in range(count):
+            word = rng.choice(_STUB_WORDS)
+            if i % 8 == 0:
+                word = f"{'' if i == 0 else chr(10)}{i // 8 + 1}. {word.capitalize()}"
+            elif i % 8 == 7 or i == count - 1:
+                word += '?'
+            words.append(word)
+        return words
+
+    def _duration(self, n_tokens):
+        if not self.tokens_per_sec:
+            return self.latency
+        return self.latency + n_tokens / self.tokens_per_sec
+
+    def _check_timeout(self, duration, timeout):
+        if timeout is not None and duration > timeout:
+            time.sleep(timeout)
+            raise TimeoutError(f"stub completion exceeded {timeout:.1f}s")
+
+    def complete(self, messages, temperature, max_tokens, timeout=None, response_format=None, **kwargs):
+        words = self._words(messages, max_tokens)
+        duration = self._duration(len(words))
+        self._check_timeout(duration, timeout)
+        time.sleep(duration)
+        text = ' '.join(words).replace(' \n', '\n')
+        if (response_format or {}).get('type') == 'json_object':
+            return self._json_reply(messages, text)
+        return text
+
+    def _json_reply(self, messages, text):
+        prompt = messages[-1]['content'] if messages else ''
+        templates = re.findall(r'\{.*\}', prompt)
+        try:
+            keys = list(json.loads(templates[-1]))
+        except (IndexError, ValueError):
+            keys = ['text']
+        return json.dumps({key: text for key in keys})
+
+    def stream(self, messages, temperature, max_tokens, timeout=None, **kwargs):
+        words = self._words(messages, max_tokens)
+        self._check_timeout(self.latency, timeout)
+        return self._stream_words(words)
+
+    def _stream_words(self, words):
+        time.sleep(self.latency)
+        for i, word in enumerate(words):
+            if self.tokens_per_sec:
+                time.sleep(1.0 / self.tokens_per_sec)
+            yield word if i == 0 or word.startswith('\n') else ' ' + word
+
+
+def stub_from_env():
+    profile = os.environ.get('LLM_STUB_PROFILE', 'instant')
+    latency, tokens_per_sec = STUB_PROFILES[profile]
+    if os.environ.get('LLM_STUB_LATENCY'):
+        latency = float(os.environ['LLM_STUB_LATENCY'])
+    if os.environ.get('LLM_STUB_TOKENS_PER_SEC'):
+        tokens_per_sec = float(os.environ['LLM_STUB_TOKENS_PER_SEC']) or None
+    return StubBackend(latency=latency, tokens_per_sec=tokens_per_sec, profile=profile)
+
+
+def backend_from_env(openai_client, model):
+    kind = os.environ.get('LLM_BACKEND', 'openai').lower()
+    if kind == 'stub':
+        return stub_from_env()
+    if kind != 'openai':
+        raise ValueError(f"Unknown LLM_BACKEND {kind!r}")
+    return OpenAIBackend(openai_client, model)
+
+
+# ─── HTTP STAND-IN ───────────────────────────
+def make_http_handler(backend):
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            request = json.loads(body or b'{}')
+            params = {
+                'messages': request.get('messages', []),
+                'temperature': request.get('temperature', 1.0),
+                'max_tokens': request.get('max_tokens') or 200,
+            }
+            if request.get('response_format') and not request.get('stream'):
+                params['response_format'] = request['response_format']
+            completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+            model = request.get('model', backend.model)
+
+            if request.get('stream'):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Connection', 'close')
+                self.end_headers()
+                self.close_connection = True
+                for delta in backend.stream(**params):
+                    self._event({
+                        'id': completion_id,
+                        'object': 'chat.completion.chunk',
+                        'created': int(time.time()),
+                        'model': model,
+                        'choices': [{'index': 0, 'delta': {'content': delta}, 'finish_reason': None}]
+                    })
+                self.wfile.write(b'data: [DONE]\n\n')
+                return
+
+            text = backend.complete(**params)
+            payload = json.dumps({
+                'id': completion_id,
+                'object': 'chat.completion',
+                'created': int(time.time()),
+                'model': model,
+                'choices': [{
+                    'index': 0,
+                    'finish_reason': 'stop',
+                    'message': {'role': 'assistant', 'content': text}
+                }],
+                'usage': {'prompt_tokens': 0, 'completion_tokens': len(text.split()),
+                          'total_tokens': len(text.split())}
+            }).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def _event(self, data):
+            self.wfile.write(f"data: {json.dumps(data)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+
+        def log_message(self, *args):
+            pass
+
+    return StubHandler
+
+
+def serve_http_stub(port, backend):
+    """Serve ``backend`` as /v1/chat/completions on 127.0.0.1:``port`` in a daemon thread."""
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_http_handler(backend))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='OpenAI-compatible stub server')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--profile', choices=sorted(STUB_PROFILES), default='gpt4')
+    args = parser.parse_args()
+
+    latency, tokens_per_sec = STUB_PROFILES[args.profile]
+    serve_http_stub(args.port, StubBackend(latency, tokens_per_sec, profile=args.profile))
+    print(f"Stub OpenAI ({args.profile}) listening on http://127.0.0.1:{args.port}/v1")
+    threading.Event().wait()
+
+
+if __name__ == '__main__':
+    main()
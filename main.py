@@ -1,35 +1,60 @@
 import os
-import requests
 import io
+import time
+import random
+import csv
 import json
-from flask import (Flask, render_template, request, redirect,session, url_for, flash,jsonify)
-from datetime import datetime
+import zlib
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from flask import (Flask, render_template, request, redirect,session, url_for, flash,jsonify,
+                   Response, stream_with_context, make_response, send_file, g)
+from datetime import datetime, timedelta, timezone
 from flask_login import login_required
 from flask_wtf.csrf import CSRFProtect, generate_csrf, CSRFError
-from xhtml2pdf import pisa
 from functools import wraps
 import logging
+import atexit
+import traceback
 from google.api_core.exceptions import GoogleAPIError
-import firebase_admin
-from firebase_admin import credentials, firestore, auth
+from firebase_admin import firestore
 
 FIREBASE_WEB_API_KEY = os.environ.get('FIREBASE_WEB_API_KEY')
 from firebase_admin.firestore import SERVER_TIMESTAMP
 from google.cloud.firestore_v1.base_query import FieldFilter
-import openai
 
 try:
     from openai.error import OpenAIError
 except ImportError:
     OpenAIError = Exception
 
+try:
+    from openai import RateLimitError
+except ImportError:
+    from openai.error import RateLimitError
+
+try:
+    # APITimeoutError is a subclass in the 1.x SDK
+    from openai import APIConnectionError
+except ImportError:
+    from openai.error import APIConnectionError
+
+try:
+    # what the SDK's stream iterator raises when the connection drops mid-reply
+    from httpx import TransportError
+except ImportError:
+    TransportError = ConnectionError
+
 from prompts_py import (
     generate_history_questions_prompt,
     generate_diagnosis_prompt,
     generate_subjective_field_prompt,
     generate_subjective_diagnosis_prompt,
+    generate_subjective_prefill_prompt,
     generate_perspectives_field_prompt,
     generate_perspectives_diagnosis_prompt,
+    generate_perspectives_prefill_prompt,
     generate_initial_plan_prompt,
     generate_initial_plan_summary_prompt,
     generate_patho_possible_source_prompt,
@@ -41,85 +66,322 @@ from prompts_py import (
     generate_smart_goals_prompt,
     generate_treatment_plan_prompt,
     generate_treatment_summary_prompt,
-    generate_followup_prompt
+    generate_followup_prompt,
+    assessment_text
 )
+from clients import LazyClient, db, auth, ai_client
+from identity_client import PasswordSignInClient
+from cache import LRUCache, cache_from_env
+from pdf_cache import file_digest, report_etag, report_cache_from_env
+from jobs import job_queue_from_env
+from pdf_renderer import renderer_from_env
+from ratelimit import RateLimitTimeout, limiter_from_env
+from circuit import CircuitBreaker, CircuitOpenError, CLOSED
+from prefetch import Prefetcher
+from prompt_budget import count_tokens
+from llm_backends import backend_from_env
+from audit import AuditLogWriter, audit_institute
+from patient_ids import PatientIdAllocator
+from search_index import SEARCH_FIELD, search_terms, query_term, matches as search_matches
+from patient_record import (PatientRecord, load_patient_record, save_stage, create_case,
+                            update_patient, REPORT_SECTIONS)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-openai.api_key = os.environ['OPENAI_API_KEY']
-
-# ─── FIREBASE INIT ───────────────────────────
-# Load the service-account JSON from a Render Secret File
-# ─── DEBUG: Inspect secret-file mount ─────────────────────────
-# ---- Handle service account JSON if present in env ----
-if os.environ.get('GOOGLE_APPLICATION_CREDENTIALS_JSON'):
-    # Write the JSON to a temp file and set GOOGLE_APPLICATION_CREDENTIALS to its path
-    with open('serviceAccount.json', 'w') as f:
-        f.write(os.environ['GOOGLE_APPLICATION_CREDENTIALS_JSON'])
-    os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = os.path.abspath('serviceAccount.json')
-
-SECRETS_DIR = "/etc/secrets"
-print("DEBUG: /etc/secrets exists?", os.path.isdir(SECRETS_DIR))
-if os.path.isdir(SECRETS_DIR):
-    print("DEBUG: /etc/secrets contents:", os.listdir(SECRETS_DIR))
-
-# ─── FETCH ENV-VAR & SHOW PATH ─────────────────────────────────
-cred_path = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
-print(f"DEBUG: GOOGLE_APPLICATION_CREDENTIALS = {cred_path!r}")
-if not cred_path:
-    raise RuntimeError("Missing GOOGLE_APPLICATION_CREDENTIALS")
-
-# ─── TRY LOADING & INITIALIZING ───────────────────────────────
-try:
-    # 1) Read & parse the JSON
-    with open(cred_path, "r") as f:
-        sa = json.load(f)
-    print("DEBUG: Loaded service-account JSON, project_id =", sa.get("project_id"))
-
-    # 2) Initialize Firebase
-    cred = credentials.Certificate(cred_path)
-    firebase_admin.initialize_app(cred, {"projectId": sa.get("project_id")})
-    print("DEBUG: Firebase Admin SDK initialized successfully")
-
-    # 3) Test Firestore access
-    db = firestore.client()
-    col_ids = [c.id for c in db.collections()]
-    print("DEBUG: Firestore collections:", col_ids)
-
-except Exception:
-    print("DEBUG: Exception during Firebase init:")
-    traceback.print_exc()
-    # re-raise so Render still fails if it’s truly broken
-    raise
-
-# Initialize the Admin SDK straight from the file
-
-# Then get your Firestore client as usual
-db = firestore.client()
-
-def get_ai_suggestion(prompt: str) -> str:
-    resp = openai.chat.completions.create(
-        model="gpt-4-turbo",
-        messages=[{
-            "role": "system",
-            "content": "You are a helpful clinical reasoning assistant."
-        }, {
-            "role": "user",
-            "content": prompt
-        }],
-        temperature=0.7,
-        max_tokens=200)
-    return resp.choices[0].message.content
+# ─── CLIENTS ─────────────────────────────────
+# Firebase, Firestore and OpenAI are created lazily on first use, so importing
+# this module (in every gunicorn worker, or in a test) does no I/O. The
+# Firestore connectivity probe lives in /healthz.
+
+AI_MODEL = os.environ.get('AI_MODEL', 'gpt-4-turbo')
+AI_TEMPERATURE = 0.7
+AI_MAX_TOKENS = 200
+
+# LLM_BACKEND=stub answers offline with deterministic text (benchmarks, CI)
+llm = backend_from_env(ai_client, AI_MODEL)
+
+# Identical prompts (same button, same inputs) are answered from here
+ai_cache = cache_from_env()
+
+def _chat_messages(prompt):
+    return [{
+        "role": "system",
+        "content": "You are a helpful clinical reasoning assistant."
+    }, {
+        "role": "user",
+        "content": prompt
+    }]
+
+# Keeps bursts of suggestion clicks inside the OpenAI requests/min and tokens/min budget
+ai_limiter = limiter_from_env()
+AI_MAX_RETRIES = int(os.environ.get('AI_MAX_RETRIES', 3))
+# Per-call timeout instead of the SDK's 10-minute default
+AI_TIMEOUT = float(os.environ.get('AI_TIMEOUT', 20))
+
+# Fails fast while OpenAI is degraded instead of tying up workers on timeouts
+ai_breaker = CircuitBreaker(
+    llm.name,
+    failure_threshold=int(os.environ.get('AI_BREAKER_FAILURES', 5)),
+    reset_timeout=float(os.environ.get('AI_BREAKER_RESET', 30))
+)
+
+def settle_breaker(error):
+    """
+    Only an unhealthy upstream counts toward opening the circuit: timeouts,
+    connection errors and 5xx. A 4xx (say, an oversized prompt) means the
+    backend answered, and anything else never reached it.
+    """
+    status = getattr(error, 'status_code', None) or getattr(error, 'http_status', None)
+    if isinstance(error, (TimeoutError, ConnectionError, APIConnectionError, TransportError)) \
+            or (status is not None and status >= 500):
+        ai_breaker.record_failure()
+    elif status is not None:
+        ai_breaker.record_success()
+    else:
+        ai_breaker.release()
+
+def create_completion(prompt, stream=False, max_tokens=AI_MAX_TOKENS, **kwargs):
+    """
+    Call the LLM backend through the circuit breaker and rate limiter, backing
+    off exponentially on 429s. Returns the text, or an iterator of text deltas
+    when ``stream`` is set.
+    """
+    ai_breaker.before_call()
+    prompt_tokens = count_tokens(prompt)
+    logger.info(f"AI call: ~{prompt_tokens} prompt tokens, up to {max_tokens} completion tokens")
+    deadline = time.time() + ai_limiter.max_wait
+
+    call = llm.stream if stream else llm.complete
+    delay = 0.5
+    for attempt in range(AI_MAX_RETRIES + 1):
+        # every attempt is a request against the quota, retries included
+        try:
+            ai_limiter.acquire(prompt_tokens + max_tokens, deadline=deadline)
+        except RateLimitTimeout:
+            ai_breaker.release()
+            raise
+        try:
+            resp = call(
+                _chat_messages(prompt),
+                temperature=AI_TEMPERATURE,
+                max_tokens=max_tokens,
+                timeout=AI_TIMEOUT,
+                **kwargs)
+        except RateLimitError:
+            sleep_for = delay * (1 + random.random())
+            if attempt == AI_MAX_RETRIES or time.time() + sleep_for > deadline:
+                # OpenAI is up, we are over quota: not a reason to open the circuit
+                ai_breaker.release()
+                raise
+            logger.warning(f"OpenAI rate limited; retrying in {sleep_for:.1f}s")
+            time.sleep(sleep_for)
+            delay *= 2
+        except Exception as e:
+            settle_breaker(e)
+            raise
+        else:
+            ai_breaker.record_success()
+            return resp
+
+def get_ai_suggestion(prompt: str, max_tokens=AI_MAX_TOKENS, **kwargs) -> str:
+    cache_key = ai_cache.make_key(llm.model, AI_TEMPERATURE, max_tokens, prompt)
+    cached = ai_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    suggestion = create_completion(prompt, max_tokens=max_tokens, **kwargs)
+    ai_cache.set(cache_key, suggestion)
+    return suggestion
+
+def stream_ai_suggestion(prompt: str):
+    """Yield the completion in chunks as the backend generates them."""
+    cache_key = ai_cache.make_key(llm.model, AI_TEMPERATURE, AI_MAX_TOKENS, prompt)
+    cached = ai_cache.get(cache_key)
+    if cached is not None:
+        yield cached
+        return
+
+    stream = create_completion(prompt, stream=True)
+    parts = []
+    try:
+        for delta in stream:
+            parts.append(delta)
+            yield delta
+    except Exception as e:
+        settle_breaker(e)
+        raise
+    ai_cache.set(cache_key, ''.join(parts))
+
+def wants_stream():
+    return (request.args.get('stream') == '1'
+            or 'text/event-stream' in request.headers.get('Accept', ''))
+
+def sse_event(data, event=None):
+    payload = f"data: {json.dumps(data)}\n\n"
+    return f"event: {event}\n{payload}" if event else payload
+
+AI_UNAVAILABLE = 'AI temporarily unavailable. Please try again shortly.'
+
+def ai_unavailable_response(retry_after):
+    response = jsonify({'error': AI_UNAVAILABLE, 'code': 'ai_unavailable'})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(int(retry_after))
+    return response
+
+def ai_response(prompt, key='suggestion', **extra):
+    """JSON reply by default; Server-Sent Events when the client asks for a stream."""
+    if not wants_stream():
+        try:
+            return jsonify({**extra, key: get_ai_suggestion(prompt).strip()})
+        except CircuitOpenError as e:
+            return ai_unavailable_response(e.retry_after)
+        except RateLimitTimeout:
+            return jsonify({'error': 'AI service is busy. Please try again in a moment.'}), 503
+
+    def events():
+        try:
+            for text in stream_ai_suggestion(prompt):
+                yield sse_event({'text': text})
+            yield sse_event({'key': key, **extra}, event='done')
+        except CircuitOpenError:
+            yield sse_event({'error': AI_UNAVAILABLE, 'code': 'ai_unavailable'}, event='error')
+        except Exception as e:
+            logger.error(f"AI stream failed: {e}", exc_info=True)
+            yield sse_event({'error': 'AI service unavailable. Please try again later.'}, event='error')
+
+    return Response(stream_with_context(events()),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# Per-field completions for the prefill fallback run side by side
+ai_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('AI_FANOUT_WORKERS', 6)),
+    thread_name_prefix='ai-fanout'
+)
+
+def _as_text(value):
+    if isinstance(value, list):
+        return "\n".join(f"{i}. {item}" for i, item in enumerate(value, 1))
+    return str(value).strip()
+
+def prefill_suggestions(batch_prompt, field_prompts):
+    """
+    Suggestions for every field from one JSON-mode completion, so the shared
+    patient context is sent (and billed) once. Fields the model left out, or
+    all of them if the reply isn't valid JSON, are fetched concurrently with
+    their single-field prompts.
+    """
+    suggestions = {}
+    try:
+        raw = get_ai_suggestion(batch_prompt,
+                                max_tokens=AI_MAX_TOKENS * len(field_prompts),
+                                response_format={'type': 'json_object'})
+        parsed = json.loads(raw)
+        suggestions = {f: _as_text(parsed[f]) for f in field_prompts if parsed.get(f)}
+    except (ValueError, TypeError, AttributeError) as e:
+        logger.warning(f"Prefill reply was not usable JSON, fanning out: {e}")
+
+    missing = [f for f in field_prompts if f not in suggestions]
+    if missing:
+        futures = {f: ai_executor.submit(get_ai_suggestion, field_prompts[f]) for f in missing}
+        suggestions.update({f: future.result().strip() for f, future in futures.items()})
+    return suggestions
+
+def prefill_response(batch_prompt, field_prompts):
+    try:
+        return jsonify({'suggestions': prefill_suggestions(batch_prompt, field_prompts)})
+    except CircuitOpenError as e:
+        return ai_unavailable_response(e.retry_after)
+    except RateLimitTimeout:
+        return jsonify({'error': 'AI service is busy. Please try again in a moment.'}), 503
+
+PROVISIONAL_DIAGNOSIS_FIELDS = ('likelihood', 'structure_fault', 'symptom',
+                                'findings_support', 'findings_reject')
+
+def treatment_summary_prompt(record):
+    return generate_treatment_summary_prompt(
+        record.patient,
+        record['subjective'],
+        record['perspectives'],
+        record.assessment_plan(),
+        record['patho_mechanism'],
+        record['chronic_disease'],
+        record['clinical_flags'],
+        record['objective_assessment'],
+        record['provisional_diagnosis'],
+        record['smart_goals'],
+        record['treatment_plan'])
+
+def perspectives_field_prompts(patient_id, patient):
+    # a field's own value never enters its prompt, so these match the page's
+    # requests whatever the clinician has selected
+    record = load_patient_record(db, patient_id)
+    if record is None:
+        return []
+    return [generate_perspectives_field_prompt(record.context(), {}, f)
+            for f in PERSPECTIVES_FIELDS]
+
+# Prompts the next page will send, keyed by the stage just saved. Only
+# prompts built entirely from saved stages are listed, so a prefetch is an
+# exact hit.
+NEXT_STAGE_PROMPTS = {
+    'subjective': perspectives_field_prompts,
+    'objective_assessment': lambda patient_id, patient: [
+        generate_provisional_diagnosis_prompt(patient_id, f, patient)
+        for f in PROVISIONAL_DIAGNOSIS_FIELDS],
+    'smart_goals': lambda patient_id, patient: [
+        treatment_summary_prompt(load_patient_record(db, patient_id)
+                                 or PatientRecord(patient_id, {}, {}))],
+}
+
+# Optional (AI_PREFETCH=1): warm the cache with the next page's suggestions
+# while the clinician is on their way to it
+prefetcher = None
+if os.environ.get('AI_PREFETCH') == '1' and ai_cache.backend is not None:
+    prefetcher = Prefetcher(
+        fetch=get_ai_suggestion,
+        is_cached=lambda prompt: ai_cache.contains(
+            ai_cache.make_key(llm.model, AI_TEMPERATURE, AI_MAX_TOKENS, prompt)),
+        busy=lambda: ai_limiter.queue_depth > 0 or ai_breaker.state != CLOSED,
+        max_workers=int(os.environ.get('AI_PREFETCH_WORKERS', 2)),
+        per_user=int(os.environ.get('AI_PREFETCH_PER_USER', 30))
+    )
+
+def prefetch_next_stage(stage, patient_id):
+    build = NEXT_STAGE_PROMPTS.get(stage)
+    if prefetcher is None or build is None:
+        return
+    patient = g.patient
+    prefetcher.submit(session.get('user_id'), lambda: build(patient_id, patient))
+
+# One pooled keep-alive session per worker for Firebase password sign-in
+signin_client = LazyClient(lambda: PasswordSignInClient(
+    FIREBASE_WEB_API_KEY,
+    connect_timeout=float(os.environ.get('SIGNIN_CONNECT_TIMEOUT', 3.05)),
+    read_timeout=float(os.environ.get('SIGNIN_READ_TIMEOUT', 10))
+))
+
+# Audit entries are written in background batches instead of inside the request
+audit_writer = AuditLogWriter(
+    db,
+    flush_interval=float(os.environ.get('AUDIT_FLUSH_INTERVAL', 2.0)),
+    max_queue=int(os.environ.get('AUDIT_MAX_QUEUE', 10000))
+)
+atexit.register(audit_writer.close)
 
 def log_action(user_id, action, details=None):
     entry = {
         'user_id': user_id,
+        # denormalized so institute views are one indexed query, not one per user
+        'user_name': session.get('user_name'),
+        'institute': session.get('audit_institute'),
         'action': action,
         'details': details,
-        'timestamp': SERVER_TIMESTAMP
+        # stamped now: a server timestamp would record the flush time instead
+        'timestamp': datetime.now(timezone.utc)
     }
-    db.collection('audit_logs').add(entry)
+    audit_writer.log(entry)
 
 def fetch_patient(patient_id):
     try:
@@ -127,12 +389,80 @@ def fetch_patient(patient_id):
         if not doc.exists:
             return None
         data = doc.to_dict()
-        data['patient_id'] = doc.id
+        # IDs like "2025/07/03" are nested paths, so doc.id is only the last segment
+        data.setdefault('patient_id', patient_id)
         return data
     except GoogleAPIError as e:
         logger.error(f"Firestore error fetching patient {patient_id}: {e}", exc_info=True)
         return None
 
+# Patient IDs come from per-worker blocks so the monthly counter is not a hotspot
+patient_ids = PatientIdAllocator(db, block_size=int(os.environ.get('PATIENT_ID_BLOCK_SIZE', 10)))
+
+# Short-lived cross-request copy of patient documents, so moving through the
+# wizard and clicking "suggest" does not re-read the patient every time
+patient_cache = LRUCache(maxsize=2048, ttl=int(os.environ.get('PATIENT_CACHE_TTL', 30)))
+
+def get_patient(patient_id):
+    """Load a patient at most once per request."""
+    loaded = g.setdefault('patients', {})
+    if patient_id not in loaded:
+        patient = patient_cache.get(patient_id)
+        if patient is None:
+            patient = fetch_patient(patient_id)
+            if patient is not None:
+                patient_cache.set(patient_id, patient)
+        loaded[patient_id] = patient
+    return loaded[patient_id]
+
+def forget_patient(patient_id):
+    patient_cache.delete(patient_id)
+    g.get('patients', {}).pop(patient_id, None)
+    forget_case(patient_id)
+    report_cache.forget(patient_id)
+
+# Saved stages for the AI routes' prompt context; kept briefly, since the
+# other workers only see a new stage once their copy expires
+case_cache = LRUCache(maxsize=1024, ttl=int(os.environ.get('CASE_CACHE_TTL', 10)))
+
+# Rendered report PDFs, keyed on a hash of the record and the report templates
+report_cache = report_cache_from_env()
+REPORT_TEMPLATE_DIGEST = file_digest(
+    *(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates', name)
+      for name in ('patient_report.html', 'base.html')))
+
+# PDF rendering and bulk exports, in a low-priority process pool;
+# PDF_RENDERER=process sends report downloads there too. Nothing starts
+# here: the pool is created on first use or by gunicorn's post_worker_init
+jobs = job_queue_from_env()
+atexit.register(jobs.close)
+pdf_renderer = renderer_from_env(jobs)
+
+def get_case_record(patient_id):
+    """Load a patient's case record at most once per request."""
+    loaded = g.setdefault('case_records', {})
+    if patient_id not in loaded:
+        record = case_cache.get(patient_id)
+        if record is None:
+            record = load_patient_record(db, patient_id)
+            if record is not None:
+                case_cache.set(patient_id, record)
+        loaded[patient_id] = record
+    return loaded[patient_id]
+
+def forget_case(patient_id):
+    case_cache.delete(patient_id)
+    g.get('case_records', {}).pop(patient_id, None)
+
+def stage_saved(stage, patient_id):
+    forget_case(patient_id)
+    report_cache.forget(patient_id)
+    prefetch_next_stage(stage, patient_id)
+
+def can_access_patient(patient):
+    return not (session.get('is_admin') == 0 and
+                patient.get('physiotherapistId') != session.get('user_id'))
+
 app = Flask(__name__)
 app.secret_key =os.environ.get('SECRET_KEY', 'dev_default_key')
 app.config['WTF_CSRF_ENABLED'] = True
@@ -145,6 +475,9 @@ def datetimeformat(value, format='%d-%m-%Y'):
 
 csrf = CSRFProtect(app)
 
+# compile the report templates now, not in the first download
+app.jinja_env.get_template('patient_report.html')
+
 @app.errorhandler(CSRFError)
 def handle_csrf_error(error):
     flash("The form you submitted is invalid or has expired. Please try again.", "error")
@@ -171,6 +504,47 @@ def login_required(approved_only=True):
         return decorated_function
     return wrapper
 
+def patient_access(json_response=False):
+    """Load the route's patient into g.patient and enforce ownership."""
+    def wrapper(f):
+        @wraps(f)
+        def decorated_function(patient_id, *args, **kwargs):
+            patient = get_patient(patient_id)
+            if patient is None:
+                if json_response:
+                    return jsonify({'error': 'Patient not found'}), 404
+                return "Patient not found.", 404
+            if not can_access_patient(patient):
+                if json_response:
+                    return jsonify({'error': 'Access denied'}), 403
+                return "Access denied.", 403
+            g.patient = patient
+            return f(patient_id, *args, **kwargs)
+        return decorated_function
+    return wrapper
+
+def ai_context(f):
+    """
+    Put the prompt context for the request's patient (URL or JSON body
+    ``patient_id``) into g.ai_context, assembled from the saved stages.
+    Clients that post no patient_id get their own ``previous`` blob instead.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        data = request.get_json(silent=True) or {}
+        patient_id = kwargs.get('patient_id') or data.get('patient_id')
+        if not patient_id:
+            g.ai_context = data.get('previous', {})
+            return f(*args, **kwargs)
+        record = get_case_record(patient_id)
+        if record is None:
+            return jsonify({'error': 'Patient not found'}), 404
+        if not can_access_patient(record.patient):
+            return jsonify({'error': 'Access denied'}), 403
+        g.ai_context = record.context()
+        return f(*args, **kwargs)
+    return decorated_function
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -219,16 +593,7 @@ def login():
 
         try:
             # Firebase login
-            payload = {
-                'email': email,
-                'password': password,
-                'returnSecureToken': True
-            }
-            r = requests.post(
-                f'https://identitytoolkit.googleapis.com/v1/accounts:signInWithPassword?key={FIREBASE_WEB_API_KEY}',
-                json=payload
-            )
-            result = r.json()
+            result = signin_client.sign_in(email, password)
             if 'error' in result:
                 flash('Invalid credentials', 'danger')
                 return redirect('/login')
@@ -303,6 +668,29 @@ def admin_dashboard():
         institute=session.get('institute')
     )
 
+@app.route('/healthz')
+def healthz():
+    try:
+        collections = sum(1 for _ in db.collections())
+        return jsonify({'status': 'ok', 'firestore': 'ok', 'collections': collections})
+    except Exception as e:
+        # unauthenticated endpoint: the details stay in the log
+        logger.error(f"Health check failed: {e}", exc_info=True)
+        return jsonify({'status': 'error', 'firestore': 'unavailable'}), 503
+
+@app.route('/metrics')
+@login_required()
+def metrics():
+    return jsonify({
+        'ai_cache': ai_cache.stats(),
+        'audit_log': audit_writer.metrics(),
+        'signin': signin_client.metrics(),
+        'ai_limiter': ai_limiter.metrics(),
+        'ai_breaker': ai_breaker.metrics(),
+        'ai_prefetch': prefetcher.metrics() if prefetcher else None,
+        'report_cache': report_cache.stats()
+    })
+
 @app.route('/debug_patients')
 @login_required()
 def debug_patients():
@@ -326,78 +714,100 @@ def debug_patients():
         return {'error': str(e)}
  
 
+PATIENT_PAGE_SIZE = 50
+
+# A search reads candidate pages until the page is full or this many
+# documents have been checked; "Load more" carries on from there
+PATIENT_SEARCH_SCAN = int(os.environ.get('PATIENT_SEARCH_SCAN', 1000))
+
+# Columns of the patient list (with the legacy field names it falls back to);
+# the long history text is never transferred
+PATIENT_LIST_FIELDS = ['patient_id', 'name', 'age_sex', 'contact', 'created_at',
+                       'ageSex', 'contactDetails', 'contextualFactorsPersonal',
+                       'subjectiveExamination.contextualFactorsPersonal']
+
 @app.route('/view_patients')
 @login_required()
 def view_patients():
     name_f = request.args.get('name', '').strip()
     id_f = request.args.get('patient_id', '').strip()
+    debug = bool(request.args.get('debug'))
+    page_size = min(request.args.get('page_size', PATIENT_PAGE_SIZE, type=int) or PATIENT_PAGE_SIZE, 200)
+    after = request.args.get('after', '')
 
     try:
-        print(f"DEBUG: Current session data:")
-        print(f"  - user_id: {session.get('user_id')}")
-        print(f"  - is_admin: {session.get('is_admin')}")
-        print(f"  - institute: {session.get('institute')}")
-        print(f"  - role: {session.get('role')}")
-
-        # Start with base collection
         patients_ref = db.collection('patients')
-        
+
         # Apply access control first
         if session.get('is_admin') == 1:
             # Admin sees all patients in their institute
             if session.get('institute'):
                 query = patients_ref.where(filter=FieldFilter('institute', '==', session.get('institute')))
-                print(f"DEBUG: Admin query for institute: {session.get('institute')}")
             else:
                 # If no institute, get all (fallback)
                 query = patients_ref
-                print("DEBUG: Admin query for all patients (no institute)")
         else:
             # Regular physio sees only their patients
             query = patients_ref.where(filter=FieldFilter('physiotherapistId', '==', session.get('user_id')))
-            print(f"DEBUG: Regular physio query for user_id: {session.get('user_id')}")
-        
+
         # Apply search filters if provided
+        matcher = None
         if id_f:
-            print(f"DEBUG: Filtering by patient ID: {id_f}")
             query = query.where(filter=FieldFilter('patient_id', '==', id_f))
-        elif name_f:
-            print(f"DEBUG: Filtering by name: {name_f}")
-            # Use case-insensitive search
-            query = query.where(filter=FieldFilter('name', '>=', name_f)) \
-                         .where(filter=FieldFilter('name', '<=', name_f + '\uf8ff'))
-        
-        # Execute query and get results
-        docs = query.stream()
+        elif query_term(name_f):
+            # narrow on one stored term, then confirm the whole query per document
+            query = query.where(filter=FieldFilter(SEARCH_FIELD, 'array_contains', query_term(name_f)))
+            matcher = lambda data: search_matches(data, name_f)
+        query = query.order_by('created_at', direction=firestore.Query.DESCENDING)
+
+        # debug mode lists every stored field, so it keeps whole documents
+        if not debug:
+            query = query.select(PATIENT_LIST_FIELDS)
+
+        if after.startswith('patients/'):
+            cursor = db.document(after).get()
+            if cursor.exists:
+                query = query.start_after(cursor)
+
         patients = []
-        
-        for doc in docs:
-            patient_data = doc.to_dict()
-            patient_data['doc_id'] = doc.id
-            
-            # Ensure patient_id is set (use doc.id if not present in data)
-            if 'patient_id' not in patient_data:
-                patient_data['patient_id'] = doc.id
-                
-            patients.append(patient_data)
-            print(f"DEBUG: Found patient: {patient_data.get('name', 'No name')} (ID: {patient_data.get('patient_id', 'No ID')})")
-
-        # Sort by creation date if no search filters
-        if not name_f and not id_f:
-            patients.sort(key=lambda x: x.get('created_at', 0) if x.get('created_at') else 0, reverse=True)
-
-        print(f"DEBUG: Total patients found: {len(patients)}")
-        
-        # Debug: Print first patient data structure if any exist
-        if patients:
-            print(f"DEBUG: First patient data structure: {patients[0].keys()}")
-            
-        return render_template('view_patients.html', patients=patients)
+        next_cursor = None
+        scanned = 0
+        while True:
+            # one extra document tells us whether there is another page
+            docs = list(query.limit(page_size + 1).stream())
+            last = None
+            for doc in docs[:page_size]:
+                scanned += 1
+                last = doc
+                patient_data = doc.to_dict()
+                if matcher and not matcher(patient_data):
+                    continue
+                patient_data['doc_id'] = doc.id
+
+                # Ensure patient_id is set (use doc.id if not present in data)
+                if 'patient_id' not in patient_data:
+                    patient_data['patient_id'] = doc.id
+
+                patients.append(patient_data)
+                if len(patients) == page_size:
+                    break
+
+            if len(patients) == page_size:
+                # the next page starts after the last match, if anything follows it
+                if last is not docs[-1]:
+                    next_cursor = last.reference.path
+                break
+            if len(docs) <= page_size:
+                break
+            if scanned >= PATIENT_SEARCH_SCAN:
+                next_cursor = last.reference.path
+                break
+            query = query.start_after(last)
+
+        return render_template('view_patients.html', patients=patients,
+                               next_cursor=next_cursor, page_size=page_size)
 
     except Exception as e:
-        print(f"ERROR in view_patients: {e}")
-        import traceback
-        traceback.print_exc()
         logger.error(f"Firestore error in view_patients: {e}", exc_info=True)
         flash("Could not load your patients list. Please try again later.", "error")
         return redirect(url_for('dashboard'))
@@ -511,16 +921,7 @@ def login_institute():
         password = request.form['password']
 
         try:
-            payload = {
-                'email': email,
-                'password': password,
-                'returnSecureToken': True
-            }
-            r = requests.post(
-                f'https://identitytoolkit.googleapis.com/v1/accounts:signInWithPassword?key={FIREBASE_WEB_API_KEY}',
-                json=payload
-            )
-            result = r.json()
+            result = signin_client.sign_in(email, password)
             if 'error' in result:
                 flash("Invalid credentials.", "danger")
                 return redirect('/login_institute')
@@ -541,6 +942,9 @@ def login_institute():
             session['user_name'] = user_data.get('name')
             session['user_id']    = result.get('localId') 
             session['is_admin'] = user_data.get('is_admin', 0)
+            # a physio's session institute is the admin's email, but the audit
+            # view filters on the institute name
+            session['audit_institute'] = audit_institute(user_data, email)
 
             if session['is_admin'] == 1:
                 session['role'] = 'institute_admin'
@@ -657,38 +1061,83 @@ def approve_user(user_email):
 
 
 
+AUDIT_PAGE_SIZE = 50
+
+def audit_log_query():
+    """Audit entries visible to the current user, newest first."""
+    logs_ref = db.collection('audit_logs')
+    if session.get('is_admin') == 1:
+        query = logs_ref.where(filter=FieldFilter('institute', '==', session.get('institute')))
+    elif session.get('is_admin') == 0:
+        query = logs_ref.where(filter=FieldFilter('user_id', '==', session.get('user_id')))
+    else:
+        return None
+    return query.order_by('timestamp', direction=firestore.Query.DESCENDING)
+
 @app.route('/audit_logs')
 @login_required()
 def audit_logs():
-    logs = []
+    page_size = min(request.args.get('page_size', AUDIT_PAGE_SIZE, type=int) or AUDIT_PAGE_SIZE, 200)
+    after = request.args.get('after')
 
-    if session.get('is_admin') == 1:
-        # Admin: fetch logs for all users in their institute
-        users = db.collection('users') \
-                  .where('institute', '==', session['institute']) \
-                  .stream()
-        user_map = {u.id: u.to_dict() for u in users}
-        user_ids = list(user_map.keys())
-
-        for uid in user_ids:
-            entries = db.collection('audit_logs').where('user_id', '==', uid).stream()
-            for e in entries:
-                data = e.to_dict()
-                data['name'] = user_map[uid]['name']
-                logs.append(data)
+    query = audit_log_query()
+    if query is None:
+        return render_template('audit_logs.html', logs=[], next_cursor=None)
 
-    elif session.get('is_admin') == 0:
-        # Individual physio: only their logs
-        entries = db.collection('audit_logs').where('user_id', '==', session['user_id']).stream()
-        for e in entries:
-            data = e.to_dict()
-            data['name'] = session['user_name']
-            logs.append(data)
+    # cursors are plain document IDs; anything with a path separator is not ours
+    if after and '/' not in after:
+        cursor = db.collection('audit_logs').document(after).get()
+        if cursor.exists:
+            query = query.start_after(cursor)
 
-    # Sort by timestamp descending
-    logs.sort(key=lambda x: x.get('timestamp', 0), reverse=True)
+    # one extra document tells us whether there is another page
+    docs = list(query.limit(page_size + 1).stream())
+    next_cursor = docs[page_size - 1].id if len(docs) > page_size else None
 
-    return render_template('audit_logs.html', logs=logs)
+    logs = []
+    for d in docs[:page_size]:
+        data = d.to_dict()
+        data['name'] = data.get('user_name') or data.get('user_id')
+        logs.append(data)
+
+    return render_template('audit_logs.html', logs=logs, next_cursor=next_cursor,
+                           page_size=page_size)
+
+EXPORT_PAGE_SIZE = 500
+
+def parse_date_arg(name, source=None):
+    value = (source or request.args).get(name, '').strip()
+    if not value:
+        return None
+    return datetime.strptime(value, '%Y-%m-%d').replace(tzinfo=timezone.utc)
+
+def csv_rows(query, header, to_row):
+    """Yield CSV text one Firestore page at a time."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    cursor = None
+    while True:
+        page = query.limit(EXPORT_PAGE_SIZE)
+        if cursor is not None:
+            page = page.start_after(cursor)
+        docs = list(page.stream())
+        for d in docs:
+            writer.writerow(to_row(d.to_dict()))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        if len(docs) < EXPORT_PAGE_SIZE:
+            return
+        cursor = docs[-1]
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(wbits=31)  # 31 = gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
 
 @app.route('/export_audit_logs')
 @login_required()
@@ -696,34 +1145,39 @@ def export_audit_logs():
     if session.get('is_admin') != 1:
         return redirect('/login_institute')
 
-    users = db.collection('users') \
-              .where('institute', '==', session['institute']) \
-              .stream()
-    user_map = {u.id: u.to_dict() for u in users}
-    user_ids = list(user_map.keys())
-
-    logs = []
-    for uid in user_ids:
-        entries = db.collection('audit_logs').where('user_id', '==', uid).stream()
-        for e in entries:
-            log = e.to_dict()
-            logs.append([
-                user_map[uid]['name'],
-                log.get('action', ''),
-                log.get('details', ''),
-                log.get('timestamp', '')
-            ])
-
-    # Prepare CSV
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(['User', 'Action', 'Details', 'Timestamp'])
-    writer.writerows(logs)
-
-    response = make_response(output.getvalue())
-    response.headers['Content-Disposition'] = 'attachment; filename=audit_logs.csv'
-    response.headers['Content-Type'] = 'text/csv'
-    return response
+    try:
+        start = parse_date_arg('start')
+        end = parse_date_arg('end')
+    except ValueError:
+        flash("Dates must be in YYYY-MM-DD format.", "danger")
+        return redirect(url_for('audit_logs'))
+    action = request.args.get('action', '').strip()
+
+    query = audit_log_query()
+    if action:
+        query = query.where(filter=FieldFilter('action', '==', action))
+    if start:
+        query = query.where(filter=FieldFilter('timestamp', '>=', start))
+    if end:
+        # the end date is inclusive
+        query = query.where(filter=FieldFilter('timestamp', '<', end + timedelta(days=1)))
+
+    chunks = csv_rows(
+        query,
+        ['User', 'Action', 'Details', 'Timestamp'],
+        lambda log: [
+            log.get('user_name') or log.get('user_id', ''),
+            log.get('action', ''),
+            log.get('details', ''),
+            log.get('timestamp', '')
+        ]
+    )
+    headers = {'Content-Disposition': 'attachment; filename=audit_logs.csv'}
+    if request.args.get('gzip') == '1':
+        chunks = gzip_chunks(chunks)
+        headers['Content-Disposition'] = 'attachment; filename=audit_logs.csv.gz'
+        return Response(stream_with_context(chunks), mimetype='application/gzip', headers=headers)
+    return Response(stream_with_context(chunks), mimetype='text/csv', headers=headers)
 
 
 @app.route('/add_patient', methods=['GET', 'POST'])
@@ -743,41 +1197,23 @@ def add_patient():
             'created_at':      SERVER_TIMESTAMP
         }
 
-        # 2) build a per‑month counter key, e.g. "2025/07"
-        now       = datetime.utcnow()
-        month_key = now.strftime('%Y%m')
-
-        counter_ref = db.collection('patient_counters').document(month_key)
-
-        # 3) bump the counter transactionally
-        @firestore.transactional
-        def bump(txn):
-            snap = counter_ref.get(transaction=txn)
-            data_snap = snap.to_dict() or {}
-            if not snap.exists:
-                txn.set(counter_ref, {'count': 1})
-                return 1
-            else:
-                new_count = data_snap.get('count', 0) + 1
-                txn.update(counter_ref, {'count': new_count})
-                return new_count
-
-        seq = bump(db.transaction())
-
-        # 4) assemble your pretty patient ID "YYYY/MM/NN"
-        pid = f"{now.year:04d}/{now.month:02d}/{seq:02d}"
+        # 2) allocate the next "YYYY/MM/NN" ID from this worker's reserved block
+        pid = patient_ids.allocate()
 
-        # 5) write the patient doc under that ID
-        db.collection('patients').document(pid).set({
-            **data,
-            'patient_id': pid
-        })
+        # 3) write the patient doc under that ID, with its case aggregate;
+        #    create() refuses to overwrite if an ID were ever handed out twice
+        patient = {**data, 'patient_id': pid}
+        patient[SEARCH_FIELD] = search_terms(patient)
+        batch = db.batch()
+        batch.create(db.collection('patients').document(pid), patient)
+        create_case(batch, db, pid, patient)
+        batch.commit()
 
         log_action(session.get('user_id'),
                    'Add Patient',
                    f"Added {data['name']} (ID: {pid})")
 
-        # 6) redirect to the next screen
+        # 4) redirect to the next screen
         return redirect(url_for('subjective', patient_id=pid))
 
     # GET → render the blank form
@@ -789,14 +1225,9 @@ def add_patient():
 
 @app.route('/subjective/<path:patient_id>', methods=['GET', 'POST'])
 @login_required()
+@patient_access()
 def subjective(patient_id):
-    doc = db.collection('patients').document(
-        patient_id).get()  # type: ignore[attr-defined]
-    if not doc.exists:
-        return "Patient not found."
-    patient = doc.to_dict()
-    if session.get('is_admin') == 0 and patient.get('physiotherapistId') != session.get('user_id'):
-     return "Access denied."
+    patient = g.patient
 
     if request.method == 'POST':
         fields = [
@@ -807,7 +1238,8 @@ def subjective(patient_id):
         entry = {f: request.form[f] for f in fields}
         entry['patient_id'] = patient_id
         entry['timestamp'] = SERVER_TIMESTAMP
-        db.collection('subjective_examination').add(entry)
+        save_stage(db, patient_id, 'subjective', entry)
+        stage_saved('subjective', patient_id)
         return redirect(f'/perspectives/{patient_id}')
     return render_template('subjective.html', patient_id=patient_id, patient=patient)
 
@@ -815,14 +1247,8 @@ def subjective(patient_id):
 
 @app.route('/perspectives/<path:patient_id>', methods=['GET','POST'])
 @login_required()
+@patient_access()
 def perspectives(patient_id):
-    doc = db.collection('patients').document(patient_id).get()
-    if not doc.exists:
-        return "Patient not found."
-    patient = doc.to_dict()
-    if session.get('is_admin') == 0 and patient.get('physiotherapistId') != session.get('user_id'):
-     return "Access denied."
-
     if request.method == 'POST':
         # ← UPDATED TO MATCH YOUR HTML FIELD NAMES
         keys = [
@@ -845,7 +1271,8 @@ def perspectives(patient_id):
         })
 
         # save to your collection
-        db.collection('patient_perspectives').add(entry)
+        save_stage(db, patient_id, 'perspectives', entry)
+        stage_saved('perspectives', patient_id)
 
         # redirect to the next screen
         return redirect(url_for('initial_plan', patient_id=patient_id))
@@ -856,13 +1283,8 @@ def perspectives(patient_id):
 
 @app.route('/initial_plan/<path:patient_id>', methods=['GET','POST'])
 @login_required()
+@patient_access()
 def initial_plan(patient_id):
-    doc = db.collection('patients').document(patient_id).get()  # type: ignore[attr-defined]
-    if not doc.exists:
-        return "Patient not found."
-    patient = doc.to_dict()
-    if session.get('is_admin') == 0 and patient.get('physiotherapistId') != session.get('user_id'):
-     return "Access denied."
     if request.method == 'POST':
         sections = ['active_movements','passive_movements','passive_over_pressure',
                     'resisted_movements','combined_movements','special_tests','neuro_dynamic_examination']
@@ -870,7 +1292,8 @@ def initial_plan(patient_id):
         for s in sections:
             entry[s] = request.form.get(s)
             entry[f"{s}_details"] = request.form.get(f"{s}_details", '')
-        db.collection('initial_plan').add(entry)
+        save_stage(db, patient_id, 'initial_plan', entry)
+        stage_saved('initial_plan', patient_id)
         return redirect(f'/patho_mechanism/{patient_id}')
     return render_template('initial_plan.html', patient_id=patient_id)
 
@@ -878,14 +1301,8 @@ def initial_plan(patient_id):
 
 @app.route('/patho_mechanism/<path:patient_id>', methods=['GET', 'POST'])
 @login_required()
+@patient_access()
 def patho_mechanism(patient_id):
-    doc = db.collection('patients').document(
-        patient_id).get()  # type: ignore[attr-defined]
-    if not doc.exists:
-        return "Patient not found."
-    patient = doc.to_dict()
-    if session.get('is_admin') == 0 and patient.get('physiotherapistId') != session.get('user_id'):
-     return "Access denied."
     if request.method == 'POST':
         keys = [
             'area_involved', 'presenting_symptom', 'pain_type', 'pain_nature',
@@ -895,30 +1312,16 @@ def patho_mechanism(patient_id):
         entry = {k: request.form[k] for k in keys}
         entry['patient_id'] = patient_id
         entry['timestamp'] = SERVER_TIMESTAMP
-        db.collection('patho_mechanism').add(entry)
+        save_stage(db, patient_id, 'patho_mechanism', entry)
+        stage_saved('patho_mechanism', patient_id)
         return redirect(f'/chronic_disease/{patient_id}')
     return render_template('patho_mechanism.html', patient_id=patient_id)
 
 
 @app.route('/chronic_disease/<path:patient_id>', methods=['GET','POST'])
 @login_required()
+@patient_access()
 def chronic_disease(patient_id):
-    # ─── ACCESS CONTROL ─────────────────────────────────────────────────────────────────
-    # 1) Fetch the patient record
-    patient_ref = db.collection('patients').document(patient_id)
-    patient_doc = patient_ref.get()
-    if not patient_doc.exists:
-        flash("Patient not found.", "danger")
-        return redirect(url_for('view_patients'))
-    patient = patient_doc.to_dict()
-
-    # 2) If non-admin, block access unless this is your patient
-    if session.get('is_admin') == 0 and \
-       patient.get('physiotherapistId') != session.get('user_id'):
-        flash("Access denied.", "danger")
-        return redirect(url_for('view_patients'))
-    # ────────────────────────────────────────────────────────────────────────────────────
-
     if request.method == 'POST':
         # Pull back all selected causes as a Python list
         causes = request.form.getlist('maintenance_causes')
@@ -929,7 +1332,8 @@ def chronic_disease(patient_id):
             'timestamp':        SERVER_TIMESTAMP
         }
         # Save the chronic-disease entry
-        db.collection('chronic_diseases').add(entry)
+        save_stage(db, patient_id, 'chronic_disease', entry)
+        stage_saved('chronic_disease', patient_id)
 
         # Then move on to the next screen
         return redirect(url_for('clinical_flags', patient_id=patient_id))
@@ -943,14 +1347,8 @@ def chronic_disease(patient_id):
 
 @app.route('/clinical_flags/<path:patient_id>', methods=['GET', 'POST'])
 @login_required()
+@patient_access()
 def clinical_flags(patient_id):
-    # fetch patient record just like your other screens
-    doc = db.collection('patients').document(patient_id).get()
-    if not doc.exists:
-        return "Patient not found."
-    patient = doc.to_dict()
-    if session.get('is_admin') == 0 and patient.get('physiotherapistId') != session.get('user_id'):
-     return "Access denied."
     if request.method == 'POST':
         entry = {
             'patient_id': patient_id,
@@ -960,7 +1358,8 @@ def clinical_flags(patient_id):
             'blue_flags':    request.form.get('blue_flags', ''),
             'timestamp':     SERVER_TIMESTAMP
         }
-        db.collection('clinical_flags').add(entry) 
+        save_stage(db, patient_id, 'clinical_flags', entry)
+        stage_saved('clinical_flags', patient_id)
         return redirect(url_for('objective_assessment', patient_id=patient_id))
 
 
@@ -970,15 +1369,8 @@ def clinical_flags(patient_id):
 @app.route('/objective_assessment/<path:patient_id>', methods=['GET','POST'])
 @csrf.exempt
 @login_required()
+@patient_access()
 def objective_assessment(patient_id):
-    # (fetch patient, check access—same as your other screens)
-    doc = db.collection('patients').document(patient_id).get()
-    if not doc.exists:
-        return "Patient not found."
-    patient = doc.to_dict()
-    if session.get('is_admin') == 0 and patient.get('physiotherapistId') != session.get('user_id'):
-     return "Access denied."
-
     if request.method == 'POST':
         entry = {
             'patient_id': patient_id,
@@ -986,7 +1378,8 @@ def objective_assessment(patient_id):
             'plan_details':  request.form.get('plan_details',''),
             'timestamp':     SERVER_TIMESTAMP
         }
-        db.collection('objective_assessments').add(entry)
+        save_stage(db, patient_id, 'objective_assessment', entry)
+        stage_saved('objective_assessment', patient_id)
         return redirect(f'/provisional_diagnosis/{patient_id}')
 
     return render_template('objective_assessment.html', patient_id=patient_id)
@@ -995,14 +1388,8 @@ def objective_assessment(patient_id):
 
 @app.route('/provisional_diagnosis/<path:patient_id>', methods=['GET', 'POST'])
 @login_required()
+@patient_access()
 def provisional_diagnosis(patient_id):
-    doc = db.collection('patients').document(
-        patient_id).get()  # type: ignore[attr-defined]
-    if not doc.exists:
-        return "Patient not found."
-    patient = doc.to_dict()
-    if session.get('is_admin') == 0 and patient.get('physiotherapistId') != session.get('user_id'):
-     return "Access denied."
     if request.method == 'POST':
         keys = [
             'likelihood', 'structure_fault', 'symptom', 'findings_support',
@@ -1011,21 +1398,16 @@ def provisional_diagnosis(patient_id):
         entry = {k: request.form[k] for k in keys}
         entry['patient_id'] = patient_id
         entry['timestamp'] = SERVER_TIMESTAMP
-        db.collection('provisional_diagnosis').add(entry)
+        save_stage(db, patient_id, 'provisional_diagnosis', entry)
+        stage_saved('provisional_diagnosis', patient_id)
         return redirect(f'/smart_goals/{patient_id}')
     return render_template('provisional_diagnosis.html', patient_id=patient_id)
 
 
 @app.route('/smart_goals/<path:patient_id>', methods=['GET', 'POST'])
 @login_required()
+@patient_access()
 def smart_goals(patient_id):
-    doc = db.collection('patients').document(
-        patient_id).get()  # type: ignore[attr-defined]
-    if not doc.exists:
-        return "Patient not found."
-    patient = doc.to_dict()
-    if session.get('is_admin') == 0 and patient.get('physiotherapistId') != session.get('user_id'):
-     return "Access denied."
     if request.method == 'POST':
         keys = [
             'patient_goal', 'baseline_status', 'measurable_outcome',
@@ -1034,40 +1416,31 @@ def smart_goals(patient_id):
         entry = {k: request.form[k] for k in keys}
         entry['patient_id'] = patient_id
         entry['timestamp'] = SERVER_TIMESTAMP
-        db.collection('smart_goals').add(entry)
+        save_stage(db, patient_id, 'smart_goals', entry)
+        stage_saved('smart_goals', patient_id)
         return redirect(f'/treatment_plan/{patient_id}')
     return render_template('smart_goals.html', patient_id=patient_id)
 
 
 @app.route('/treatment_plan/<path:patient_id>', methods=['GET', 'POST'])
 @login_required()
+@patient_access()
 def treatment_plan(patient_id):
-    doc = db.collection('patients').document(
-        patient_id).get()  # type: ignore[attr-defined]
-    if not doc.exists:
-        return "Patient not found."
-    patient = doc.to_dict()
-    if session.get('is_admin') == 0 and patient.get('physiotherapistId') != session.get('user_id'):
-     return "Access denied."
     if request.method == 'POST':
         keys = ['treatment_plan', 'goal_targeted', 'reasoning', 'reference']
         entry = {k: request.form[k] for k in keys}
         entry['patient_id'] = patient_id
         entry['timestamp'] = SERVER_TIMESTAMP
-        db.collection('treatment_plan').add(entry)
+        save_stage(db, patient_id, 'treatment_plan', entry)
+        stage_saved('treatment_plan', patient_id)
         return redirect('/dashboard')
     return render_template('treatment_plan.html', patient_id=patient_id)
 
 @app.route('/follow_ups/<path:patient_id>', methods=['GET', 'POST'])
 @login_required()
+@patient_access()
 def follow_ups(patient_id):
-    # 1) fetch patient and permission check
-    patient_doc = db.collection('patients').document(patient_id).get()
-    if not patient_doc.exists:
-        return "Patient not found", 404
-    patient = patient_doc.to_dict()
-    if session.get('is_admin') == 0 and patient.get('physiotherapistId') != session.get('user_id'):
-     return "Access denied."
+    patient = g.patient
 
     # 2) handle new entry
     if request.method == 'POST':
@@ -1081,7 +1454,8 @@ def follow_ups(patient_id):
             'treatment_plan':  request.form['treatment_plan'],
             'timestamp':       SERVER_TIMESTAMP
         }
-        db.collection('follow_ups').add(entry)
+        save_stage(db, patient_id, 'follow_up', entry)
+        stage_saved('follow_up', patient_id)
         log_action(session['user_id'], 'Add Follow-Up',
                    f"Follow-up #{entry['session_number']} for {patient_id}")
         return redirect(f'/follow_ups/{patient_id}')
@@ -1099,16 +1473,9 @@ def follow_ups(patient_id):
 # ─── VIEW FOLLOW-UPS ROUTE ─────────────────────────────────────────────
 @app.route('/view_follow_ups/<path:patient_id>')
 @login_required()
+@patient_access()
 def view_follow_ups(patient_id):
-    doc = db.collection('patients').document(patient_id).get()
-    if not doc.exists:
-        return "Patient not found."
-    patient = doc.to_dict()
-
-    # Access control
-    if session.get('is_admin') == 0 and \
-       patient.get('physiotherapistId') != session.get('user_id'):
-        return "Access denied."
+    patient = g.patient
 
     docs = (
         db.collection('follow_ups')
@@ -1127,16 +1494,9 @@ def view_follow_ups(patient_id):
 
 @app.route('/edit_patient/<path:patient_id>', methods=['GET', 'POST'])
 @login_required()
+@patient_access()
 def edit_patient(patient_id):
-    doc_ref = db.collection('patients').document(patient_id)
-    doc = doc_ref.get()
-    if not doc.exists:
-        return "Patient not found", 404
-
-    patient = doc.to_dict()
-
-    if session.get('is_admin') == 0 and patient.get('physiotherapistId') != session.get('user_id'):
-      return "Access denied."
+    patient = g.patient
 
     if request.method == 'POST':
         updated_data = {
@@ -1144,7 +1504,9 @@ def edit_patient(patient_id):
             'age_sex': request.form['age_sex'],
             'contact': request.form['contact']
         }
-        doc_ref.update(updated_data)
+        updated_data[SEARCH_FIELD] = search_terms({**patient, **updated_data, 'patient_id': patient_id})
+        update_patient(db, patient_id, updated_data)
+        forget_patient(patient_id)
         log_action(session['user_id'], 'Edit Patient', f"Edited patient {patient_id}")
         return redirect(url_for('view_patients'))
 
@@ -1154,82 +1516,73 @@ def edit_patient(patient_id):
 @app.route('/patient_report/<path:patient_id>')
 @login_required()
 def patient_report(patient_id):
-    doc = db.collection('patients').document(
-        patient_id).get()  # type: ignore[attr-defined]
-    if not doc.exists:
+    # patient and all report sections are fetched concurrently
+    record = load_patient_record(db, patient_id, REPORT_SECTIONS)
+    if record is None:
         return "Patient not found."
-    patient = doc.to_dict()
+    patient = record.patient
     if session.get('is_admin') == 0 and patient.get('physiotherapistId') != session.get('user_id'):
       return "Access denied."
 
-    # fetch each section
-    def fetch_one(coll):
-        d = db.collection(coll).where('patient_id', '==',
-                                      patient_id).limit(1).get()
-        return d[0].to_dict() if d else {}
-
-    subjective = fetch_one('subjective_examination')
-    perspectives = fetch_one('patient_perspectives')
-    diagnosis = fetch_one('provisional_diagnosis')
-    treatment = fetch_one('treatment_plan')
-    goals = fetch_one('smart_goals')
     return render_template('patient_report.html',
                            patient=patient,
-                           subjective=subjective,
-                           perspectives=perspectives,
-                           diagnosis=diagnosis,
-                           goals=goals,
-                           treatment=treatment)
+                           subjective=record['subjective'],
+                           perspectives=record['perspectives'],
+                           diagnosis=record['provisional_diagnosis'],
+                           goals=record['smart_goals'],
+                           treatment=record['treatment_plan'])
 
 
+def render_report_html(record):
+    return render_template(
+        'patient_report.html',
+        patient=record.patient,
+        subjective=record['subjective'],
+        perspectives=record['perspectives'],
+        diagnosis=record['provisional_diagnosis'],
+        goals=record['smart_goals'],
+        treatment=record['treatment_plan']
+    )
+
 @app.route('/download_report/<path:patient_id>')
 @login_required()
 def download_report(patient_id):
-    # 1) Fetch patient record and check permissions
-    doc = db.collection('patients').document(patient_id).get()
-    if not doc.exists:
+    # 1) Fetch patient record and report sections, then check permissions
+    record = load_patient_record(db, patient_id, REPORT_SECTIONS)
+    if record is None:
         return "Patient not found.", 404
-    patient = doc.to_dict()
+    patient = record.patient
     if session.get('is_admin') == 0 and patient.get('physiotherapistId') != session.get('user_id'):
      return "Access denied."
 
-
-    # 2) Fetch each section for the report
-    def fetch_one(coll):
-        result = db.collection(coll) \
-                     .where('patient_id', '==', patient_id) \
-                     .limit(1).get()
-        return result[0].to_dict() if result else {}
-
-    subjective   = fetch_one('subjective_examination')
-    perspectives = fetch_one('patient_perspectives')
-    diagnosis    = fetch_one('provisional_diagnosis')
-    goals        = fetch_one('smart_goals')
-    treatment    = fetch_one('treatment_plan')
-
-    # 3) Render the HTML template
-    rendered = render_template(
-        'patient_report.html',
-        patient=patient,
-        subjective=subjective,
-        perspectives=perspectives,
-        diagnosis=diagnosis,
-        goals=goals,
-        treatment=treatment
-    )
-
-    # 4) Generate PDF
-    pdf = io.BytesIO()
-    pisa_status = pisa.CreatePDF(io.StringIO(rendered), dest=pdf)
-    if pisa_status.err:
-        return "Error generating PDF", 500
-
-    # 5) Return the PDF
-    response = make_response(pdf.getvalue())
-    response.headers['Content-Type'] = 'application/pdf'
-    response.headers['Content-Disposition'] = (
-        f'attachment; filename={patient_id}_report.pdf'
-    )
+    # 2) Unchanged since the client's copy: nothing to send
+    etag = report_etag(patient, record.sections, REPORT_TEMPLATE_DIGEST)
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    else:
+        pdf = report_cache.get(etag)
+        if pdf is None:
+            # 3) Render the HTML template and generate the PDF
+            # (a pending flash message would be rendered into the page, so that copy isn't kept)
+            cacheable = not session.get('_flashes')
+            rendered = render_report_html(record)
+            try:
+                pdf = pdf_renderer.render(rendered)
+            except Exception as e:
+                logger.error(f"PDF rendering failed for {patient_id}: {e}", exc_info=True)
+                return "Error generating PDF", 500
+            if cacheable:
+                report_cache.set(patient_id, etag, pdf)
+
+        # 4) Return the PDF
+        response = make_response(pdf)
+        response.headers['Content-Type'] = 'application/pdf'
+        response.headers['Content-Disposition'] = (
+            f'attachment; filename={patient_id}_report.pdf'
+        )
+    # browsers must revalidate, and shared caches never see patient data
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
     log_action(
         session.get('user_id'),
         'Download Report',
@@ -1238,6 +1591,173 @@ def download_report(patient_id):
     return response
 
 
+# ─── BACKGROUND REPORT JOBS ──────────────────
+EXPORT_MAX_PATIENTS = int(os.environ.get('EXPORT_MAX_PATIENTS', 2000))
+
+def report_pdf_future(record, base_url):
+    """
+    PDF bytes for ``record`` as a future: from the report cache when it has
+    them, otherwise rendered in the job pool. Runs outside any request, so
+    templates get a request context of their own for url_for.
+    """
+    etag = report_etag(record.patient, record.sections, REPORT_TEMPLATE_DIGEST)
+    pdf = report_cache.get(etag)
+    if pdf is not None:
+        done = Future()
+        done.set_result(pdf)
+        return done
+    with app.test_request_context(base_url=base_url):
+        html = render_report_html(record)
+    future = jobs.render(html)
+
+    def keep(f):
+        if f.exception() is None:
+            report_cache.set(record.patient_id, etag, f.result())
+    future.add_done_callback(keep)
+    return future
+
+def report_file_name(patient_id):
+    return f"{patient_id.replace('/', '-')}_report.pdf"
+
+def report_job(job, patient_id, base_url):
+    record = load_patient_record(db, patient_id, REPORT_SECTIONS)
+    if record is None:
+        raise LookupError(f"Patient {patient_id} not found")
+    job.progress(0, 1)
+    pdf = report_pdf_future(record, base_url).result()
+    with open(job.path('pdf'), 'wb') as f:
+        f.write(pdf)
+    job.progress(1)
+    return os.path.basename(job.path('pdf'))
+
+def export_job(job, patient_ids, base_url):
+    """
+    Render every patient's report into one ZIP on disk. Records are loaded
+    and templated here while the pool renders, with about two PDFs per pool
+    process in flight; each PDF is written as soon as it is ready. A report
+    that cannot be loaded or rendered is skipped and listed in FAILED.txt
+    inside the ZIP and in the job state, rather than failing the export.
+    """
+    job.progress(0, len(patient_ids))
+    part = job.path('zip.part')
+    window = deque()
+    failures = []
+    done = 0
+
+    def failed(pid, error):
+        logger.warning(f"Export job {job.id}: report for {pid} failed: {error}")
+        failures.append((pid, str(error) or type(error).__name__))
+        job.note(failed=len(failures))
+
+    # PDF streams are already compressed
+    with zipfile.ZipFile(part, 'w', compression=zipfile.ZIP_STORED) as zf:
+        def write_oldest():
+            nonlocal done
+            pid, future = window.popleft()
+            try:
+                zf.writestr(report_file_name(pid), future.result())
+            except Exception as e:
+                failed(pid, e)
+            done += 1
+            job.progress(done)
+
+        for pid in patient_ids:
+            try:
+                record = load_patient_record(db, pid, REPORT_SECTIONS)
+                if record is None:
+                    raise LookupError('patient not found')
+                window.append((pid, report_pdf_future(record, base_url)))
+            except Exception as e:
+                failed(pid, e)
+                done += 1
+                job.progress(done)
+                continue
+            while len(window) >= jobs.processes * 2:
+                write_oldest()
+        while window:
+            write_oldest()
+
+        if failures:
+            zf.writestr('FAILED.txt', ''.join(f"{pid}\t{error}\n" for pid, error in failures))
+    os.replace(part, job.path('zip'))
+    return os.path.basename(job.path('zip'))
+
+def job_response(job_id):
+    return jsonify({
+        'job_id': job_id,
+        'status_url': url_for('job_status', job_id=job_id),
+        'download_url': url_for('job_download', job_id=job_id)
+    }), 202
+
+@app.route('/jobs/report/<path:patient_id>', methods=['POST'])
+@login_required()
+@patient_access(json_response=True)
+def start_report_job(patient_id):
+    job_id = jobs.submit('report', session.get('user_id'), report_job, patient_id, request.host_url,
+                         filename=report_file_name(patient_id))
+    return job_response(job_id)
+
+@app.route('/jobs/export_reports', methods=['POST'])
+@login_required()
+def start_export_job():
+    if session.get('is_admin') != 1:
+        return jsonify({'error': 'Admins only'}), 403
+    try:
+        start = parse_date_arg('start', request.form)
+        end = parse_date_arg('end', request.form)
+    except ValueError:
+        return jsonify({'error': 'Dates must be in YYYY-MM-DD format.'}), 400
+
+    query = db.collection('patients') \
+              .where(filter=FieldFilter('institute', '==', session.get('institute')))
+    if start:
+        query = query.where(filter=FieldFilter('created_at', '>=', start))
+    if end:
+        # the end date is inclusive
+        query = query.where(filter=FieldFilter('created_at', '<', end + timedelta(days=1)))
+    docs = query.select(['patient_id']).limit(EXPORT_MAX_PATIENTS + 1).stream()
+    patient_ids = [d.to_dict().get('patient_id') or d.id for d in docs]
+    if not patient_ids:
+        return jsonify({'error': 'No patients registered in that period.'}), 404
+    if len(patient_ids) > EXPORT_MAX_PATIENTS:
+        return jsonify({'error': f"More than {EXPORT_MAX_PATIENTS} patients; "
+                                 "please export a shorter date range."}), 400
+
+    job_id = jobs.submit('export', session.get('user_id'), export_job, patient_ids, request.host_url,
+                         filename=f"reports_{start:%Y-%m-%d}_{end:%Y-%m-%d}.zip"
+                         if start and end else 'reports.zip')
+    log_action(session.get('user_id'), 'Export Reports',
+               f"Started export of {len(patient_ids)} reports (job {job_id})")
+    return job_response(job_id)
+
+def owned_job(job_id):
+    state = jobs.status(job_id)
+    if state is None or state.get('owner') != session.get('user_id'):
+        return None
+    return state
+
+@app.route('/jobs/<job_id>')
+@login_required()
+def job_status(job_id):
+    state = owned_job(job_id)
+    if state is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify({k: state.get(k) for k in
+                    ('id', 'kind', 'state', 'done', 'total', 'failed', 'error', 'size', 'seconds')})
+
+@app.route('/jobs/<job_id>/download')
+@login_required()
+def job_download(job_id):
+    state = owned_job(job_id)
+    path = jobs.result_path(job_id) if state else None
+    if path is None:
+        return jsonify({'error': 'Job not found or not finished'}), 404
+    log_action(session.get('user_id'), 'Download Report',
+               f"Downloaded {state['kind']} job {job_id}")
+    return send_file(os.path.abspath(path), as_attachment=True, download_name=state.get('filename'),
+                     mimetype='application/zip' if path.endswith('.zip') else 'application/pdf')
+
+
 @app.route('/manage_users')
 @login_required()
 def manage_users():
@@ -1284,8 +1804,7 @@ def ai_past_questions():
     present_hist = data.get('present_history', '').strip()
     prompt = generate_history_questions_prompt(age_sex, present_hist)
     try:
-        suggestion = get_ai_suggestion(prompt)
-        return jsonify({'suggestion': suggestion})
+        return ai_response(prompt)
     except OpenAIError:
         return jsonify({'error': 'AI service unavailable. Please try again later.'}), 503
     except Exception:
@@ -1301,8 +1820,7 @@ def ai_provisional_diagnosis():
     past_hist = data.get('past_history', '').strip()
     prompt = generate_diagnosis_prompt(age_sex, present_hist, past_hist)
     try:
-        suggestion = get_ai_suggestion(prompt)
-        return jsonify({'suggestion': suggestion})
+        return ai_response(prompt)
     except OpenAIError:
         return jsonify({'error': 'AI service unavailable. Please try again later.'}), 503
     except Exception:
@@ -1319,8 +1837,34 @@ def ai_subjective_field(field):
     inputs = data.get('inputs', {})
     prompt = generate_subjective_field_prompt(age_sex, present_hist, past_hist, inputs, field)
     try:
-        suggestion = get_ai_suggestion(prompt)
-        return jsonify({'suggestion': suggestion})
+        return ai_response(prompt)
+    except OpenAIError:
+        return jsonify({'error': 'AI service unavailable.'}), 503
+    except Exception:
+        return jsonify({'error': 'Unexpected error.'}), 500
+
+SUBJECTIVE_FIELDS = ('body_structure', 'body_function', 'activity_performance',
+                     'activity_capacity', 'contextual_environmental', 'contextual_personal')
+
+def requested_fields(data, allowed):
+    fields = [f for f in data.get('fields') or allowed if f in allowed]
+    return fields or list(allowed)
+
+@app.route('/ai_suggestion/subjective/prefill', methods=['POST'])
+@csrf.exempt
+@login_required()
+def ai_subjective_prefill():
+    data = request.get_json() or {}
+    age_sex = data.get('age_sex', '').strip()
+    present_hist = data.get('present_history', '').strip()
+    past_hist = data.get('past_history', '').strip()
+    inputs = data.get('inputs', {})
+    fields = requested_fields(data, SUBJECTIVE_FIELDS)
+    batch_prompt = generate_subjective_prefill_prompt(age_sex, present_hist, past_hist, inputs, fields)
+    field_prompts = {f: generate_subjective_field_prompt(age_sex, present_hist, past_hist, inputs, f)
+                     for f in fields}
+    try:
+        return prefill_response(batch_prompt, field_prompts)
     except OpenAIError:
         return jsonify({'error': 'AI service unavailable.'}), 503
     except Exception:
@@ -1337,8 +1881,7 @@ def ai_subjective_diagnosis():
     inputs = data.get('inputs', {})
     prompt = generate_subjective_diagnosis_prompt(age_sex, present_hist, past_hist, inputs)
     try:
-        suggestion = get_ai_suggestion(prompt)
-        return jsonify({'suggestion': suggestion})
+        return ai_response(prompt)
     except OpenAIError:
         return jsonify({'error': 'AI service unavailable.'}), 503
     except Exception:
@@ -1347,14 +1890,36 @@ def ai_subjective_diagnosis():
 @app.route('/ai_suggestion/perspectives/<field>', methods=['POST'])
 @csrf.exempt
 @login_required()
+@ai_context
 def ai_perspectives_field(field):
     data = request.get_json() or {}
-    previous = data.get('previous', {})
     inputs = data.get('inputs', {})
+    previous = {**g.ai_context, 'perspectives': {**g.ai_context.get('perspectives', {}), **inputs}}
     prompt = generate_perspectives_field_prompt(previous, inputs, field)
     try:
-        suggestion = get_ai_suggestion(prompt)
-        return jsonify({'suggestion': suggestion})
+        return ai_response(prompt)
+    except OpenAIError:
+        return jsonify({'error': 'AI service unavailable.'}), 503
+    except Exception:
+        return jsonify({'error': 'Unexpected error.'}), 500
+
+PERSPECTIVES_FIELDS = ('knowledge', 'attribution', 'expectation', 'consequences_awareness',
+                       'locus_of_control', 'affective_aspect')
+
+@app.route('/ai_suggestion/perspectives/prefill', methods=['POST'])
+@csrf.exempt
+@login_required()
+@ai_context
+def ai_perspectives_prefill():
+    data = request.get_json() or {}
+    previous = g.ai_context
+    inputs = data.get('inputs', {})
+    fields = requested_fields(data, PERSPECTIVES_FIELDS)
+    batch_prompt = generate_perspectives_prefill_prompt(previous, inputs, fields)
+    previous = {**previous, 'perspectives': {**previous.get('perspectives', {}), **inputs}}
+    field_prompts = {f: generate_perspectives_field_prompt(previous, inputs, f) for f in fields}
+    try:
+        return prefill_response(batch_prompt, field_prompts)
     except OpenAIError:
         return jsonify({'error': 'AI service unavailable.'}), 503
     except Exception:
@@ -1363,14 +1928,14 @@ def ai_perspectives_field(field):
 @app.route('/ai_suggestion/perspectives_diagnosis', methods=['POST'])
 @csrf.exempt
 @login_required()
+@ai_context
 def ai_perspectives_diagnosis():
     data = request.get_json() or {}
-    previous = data.get('previous', {})
+    previous = g.ai_context
     inputs = data.get('inputs', {})
     prompt = generate_perspectives_diagnosis_prompt(previous, inputs)
     try:
-        suggestion = get_ai_suggestion(prompt)
-        return jsonify({'suggestion': suggestion})
+        return ai_response(prompt)
     except OpenAIError:
         return jsonify({'error': 'AI service unavailable.'}), 503
     except Exception:
@@ -1379,14 +1944,14 @@ def ai_perspectives_diagnosis():
 @app.route('/ai_suggestion/initial_plan/<field>', methods=['POST'])
 @csrf.exempt
 @login_required()
+@ai_context
 def ai_initial_plan_field(field):
     data = request.get_json() or {}
-    prev = data.get('previous', {})
+    prev = g.ai_context
     selection = data.get('selection', '').strip()
     try:
         prompt = generate_initial_plan_prompt(prev, field, selection)
-        suggestion = get_ai_suggestion(prompt)
-        return jsonify({'suggestion': suggestion})
+        return ai_response(prompt)
     except OpenAIError:
         return jsonify({'error': 'AI service unavailable.'}), 503
     except Exception:
@@ -1395,14 +1960,14 @@ def ai_initial_plan_field(field):
 @app.route('/ai_suggestion/initial_plan_summary', methods=['POST'])
 @csrf.exempt
 @login_required()
+@ai_context
 def ai_initial_plan_summary():
     data = request.get_json() or {}
-    prev = data.get('previous', {})
+    prev = g.ai_context
     assessments = data.get('assessments', {})
     try:
         prompt = generate_initial_plan_summary_prompt(prev, assessments)
-        summary = get_ai_suggestion(prompt)
-        return jsonify({'summary': summary})
+        return ai_response(prompt, 'summary')
     except OpenAIError:
         return jsonify({'error': 'AI service unavailable.'}), 503
     except Exception:
@@ -1411,14 +1976,14 @@ def ai_initial_plan_summary():
 @app.route('/ai_suggestion/patho/possible_source', methods=['POST'])
 @csrf.exempt
 @login_required()
+@ai_context
 def ai_patho_source():
     data = request.get_json() or {}
-    prev = data.get('previous', {})
+    prev = g.ai_context
     selection = data.get('selection', '').strip()
     try:
         prompt = generate_patho_possible_source_prompt(prev, selection)
-        suggestion = get_ai_suggestion(prompt)
-        return jsonify({'suggestion': suggestion})
+        return ai_response(prompt)
     except OpenAIError:
         return jsonify({'error': 'AI service unavailable.'}), 503
     except Exception:
@@ -1427,15 +1992,15 @@ def ai_patho_source():
 @app.route('/ai_suggestion/chronic/specific_factors', methods=['POST'])
 @csrf.exempt
 @login_required()
+@ai_context
 def ai_chronic_factors():
     data = request.get_json() or {}
-    prev = data.get('previous', {})
+    prev = g.ai_context
     text_input = data.get('input', '').strip()
     causes_selected = data.get('causes', [])
     try:
         prompt = generate_chronic_factors_prompt(prev, text_input, causes_selected)
-        suggestion = get_ai_suggestion(prompt)
-        return jsonify({'suggestion': suggestion})
+        return ai_response(prompt)
     except OpenAIError:
         return jsonify({'error': 'AI service unavailable.'}), 503
     except Exception:
@@ -1445,15 +2010,16 @@ def ai_chronic_factors():
 @app.route('/ai_suggestion/clinical_flags/<patient_id>/suggest', methods=['POST'])
 @csrf.exempt
 @login_required()
+@patient_access(json_response=True)
+@ai_context
 def clinical_flags_suggest(patient_id):
     data = request.get_json() or {}
-    prev = data.get('previous', {})
+    prev = g.ai_context
     field = data.get('field', '')
     text = data.get('text', '').strip()
     try:
         prompt = generate_clinical_flags_prompt(prev, field, text)
-        suggestion = get_ai_suggestion(prompt)
-        return jsonify({'suggestions': suggestion})
+        return ai_response(prompt, 'suggestions')
     except OpenAIError:
         return jsonify({'error': 'AI service unavailable.'}), 503
     except Exception:
@@ -1463,6 +2029,7 @@ def clinical_flags_suggest(patient_id):
 @app.route('/objective_assessment/<patient_id>/suggest', methods=['POST'])
 @csrf.exempt
 @login_required()
+@patient_access(json_response=True)
 def objective_assessment_suggest(patient_id):
     data = request.get_json() or {}
     logger.info(f"📘 [server] ObjectiveAssessment payload for patient {patient_id}: {data}")
@@ -1470,9 +2037,7 @@ def objective_assessment_suggest(patient_id):
     choice = data.get('value')
     prompt = generate_objective_assessment_prompt(patient_id, field, choice)
     try:
-        suggestion = get_ai_suggestion(prompt).strip()
-        logger.info(f"📘 [server] ObjectiveAssessment suggestion: {suggestion}")
-        return jsonify({'suggestion': suggestion})
+        return ai_response(prompt)
     except OpenAIError as e:
         logger.error(f"OpenAI API error in objective_assessment_suggest: {e}", exc_info=True)
         return jsonify({'error': 'AI service unavailable. Please try again later.'}), 503
@@ -1489,9 +2054,7 @@ def objective_assessment_field_suggest(field):
     choice = data.get('value', '')
     prompt = generate_objective_field_prompt(data.get('patient_id'), field, choice)
     try:
-        suggestion = get_ai_suggestion(prompt).strip()
-        logger.info(f"🧠 [server] ObjectiveAssessment suggestion for '{field}': {suggestion}")
-        return jsonify({'suggestion': suggestion})
+        return ai_response(prompt)
     except OpenAIError as e:
         logger.error(f"OpenAI API error in objective_assessment_field_suggest: {e}", exc_info=True)
         return jsonify({'error': 'AI service unavailable. Please try again later.'}), 503
@@ -1502,18 +2065,14 @@ def objective_assessment_field_suggest(field):
 @app.route('/provisional_diagnosis_suggest/<patient_id>')
 @csrf.exempt
 @login_required()
+@patient_access(json_response=True)
 def provisional_diagnosis_suggest(patient_id):
     field = request.args.get('field', '')
     logger.info(f"🧠 [server] provisional_diagnosis_suggest for patient {patient_id}, field {field}")
-    doc = db.collection('patients').document(patient_id).get()
-    if not doc.exists:
-        return jsonify({'suggestion': ''}), 404
-    patient = doc.to_dict()
+    patient = g.patient
     try:
         prompt = generate_provisional_diagnosis_prompt(patient_id, field, patient)
-        suggestion = get_ai_suggestion(prompt).strip()
-        logger.info(f"💡 [server] provisional_diagnosis_suggest → {suggestion}")
-        return jsonify({'suggestion': suggestion})
+        return ai_response(prompt)
     except OpenAIError as e:
         logger.error(f"OpenAI API error in provisional_diagnosis_suggest: {e}", exc_info=True)
         return jsonify({'suggestion': 'AI service unavailable. Please try again later.'}), 503
@@ -1524,19 +2083,22 @@ def provisional_diagnosis_suggest(patient_id):
 @app.route('/ai_suggestion/smart_goals/<field>', methods=['POST'])
 @csrf.exempt
 @login_required()
+@ai_context
 def ai_smart_goals(field):
     data = request.get_json() or {}
+    context = g.ai_context
+    # this prompt takes one flat dict: basics plus every stage's fields
     prev = {
-        **data.get('previous', {}),
-        **data.get('previous_subjective', {}),
-        **data.get('previous_perspectives', {}),
-        **data.get('previous_assessments', {})
+        **{k: v for k, v in context.items() if not isinstance(v, dict)},
+        **context.get('subjective', {}),
+        **context.get('perspectives', {}),
+        **{k: assessment_text(v) for k, v in context.get('assessments', {}).items()
+           if isinstance(v, dict) and v.get('choice')}
     }
     text = data.get('input', '').strip()
     try:
         prompt = generate_smart_goals_prompt(field, prev, text)
-        suggestion = get_ai_suggestion(prompt).strip()
-        return jsonify({'suggestion': suggestion})
+        return ai_response(prompt)
     except OpenAIError:
         return jsonify({'error': 'AI service unavailable'}), 503
     except Exception:
@@ -1550,8 +2112,7 @@ def treatment_plan_suggest(field):
     text_input = data.get('input', '').strip()
     prompt = generate_treatment_plan_prompt(field, text_input)
     try:
-        suggestion = get_ai_suggestion(prompt).strip()
-        return jsonify({'field': field, 'suggestion': suggestion})
+        return ai_response(prompt, field=field)
     except OpenAIError:
         return jsonify({'error': 'AI service unavailable. Please try again later.'}), 503
     except Exception:
@@ -1560,32 +2121,13 @@ def treatment_plan_suggest(field):
 @app.route('/ai_suggestion/treatment_plan_summary/<patient_id>')
 @csrf.exempt
 @login_required()
+@patient_access(json_response=True)
 def treatment_plan_summary(patient_id):
-    pat_doc = db.collection('patients').document(patient_id).get()
-    patient_info = pat_doc.to_dict() if pat_doc.exists else {}
-
-    def fetch_latest(collection_name):
-        coll = db.collection(collection_name) \
-            .where('patient_id', '==', patient_id) \
-            .order_by('timestamp', direction=firestore.Query.DESCENDING) \
-            .limit(1).get()
-        return coll[0].to_dict() if coll else {}
-
-    subj = fetch_latest('subjective_examination')
-    persp = fetch_latest('subjective_perspectives')
-    assess = fetch_latest('subjective_assessments')
-    patho = fetch_latest('pathophysiological_mechanism')
-    chronic = fetch_latest('chronic_disease_factors')
-    flags = fetch_latest('clinical_flags')
-    objective= fetch_latest('objective_assessment')
-    prov_dx = fetch_latest('provisional_diagnosis')
-    goals = fetch_latest('smart_goals')
-    tx_plan = fetch_latest('treatment_plan')
-
-    prompt = generate_treatment_summary_prompt(patient_info, subj, persp, assess, patho, chronic, flags, objective, prov_dx, goals, tx_plan)
+    # all ten stages are fetched concurrently
+    record = load_patient_record(db, patient_id) or PatientRecord(patient_id, {}, {})
+    prompt = treatment_summary_prompt(record)
     try:
-        summary = get_ai_suggestion(prompt).strip()
-        return jsonify({'summary': summary})
+        return ai_response(prompt, 'summary')
     except OpenAIError:
         return jsonify({'error': 'AI service unavailable. Please try again later.'}), 503
     except Exception:
@@ -1594,12 +2136,10 @@ def treatment_plan_summary(patient_id):
 @app.route('/ai/followup_suggestion/<patient_id>', methods=['POST'])
 @csrf.exempt
 @login_required()
+@patient_access(json_response=True)
 def ai_followup_suggestion(patient_id):
-    doc = db.collection('patients').document(patient_id).get()
-    if not doc.exists:
-        return jsonify({'error': 'Patient not found'}), 404
-    patient = doc.to_dict()
-    
+    patient = g.patient
+
     data = request.get_json() or {}
     session_no = data.get('session_number')
     session_date = data.get('session_date')
@@ -1609,8 +2149,7 @@ def ai_followup_suggestion(patient_id):
     
     prompt = generate_followup_prompt(patient, session_no, session_date, grade, perception, feedback, patient_id)
     try:
-        suggestion = get_ai_suggestion(prompt).strip()
-        return jsonify({'suggestion': suggestion})
+        return ai_response(prompt)
     except OpenAIError:
         return jsonify({'error': 'AI service unavailable. Please try again later.'}), 503
     except Exception:
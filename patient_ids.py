@@ -0,0 +1,47 @@
+import threading
+from datetime import datetime
+
+from firebase_admin import firestore
+
+
+class PatientIdAllocator:
+    """
+    Allocates human-readable "YYYY/MM/NN" patient IDs.
+
+    Each worker reserves a block of ``block_size`` sequence numbers from the
+    monthly counter in one transaction and hands them out locally, so the
+    shared counter document sees one write per block instead of one per
+    patient. IDs stay unique; a worker that exits mid-block leaves a gap.
+    """
+
+    def __init__(self, db, block_size=10, collection='patient_counters'):
+        self.db = db
+        self.block_size = max(1, block_size)
+        self.collection = collection
+        self._lock = threading.Lock()
+        self._month_key = None
+        self._next = 1
+        self._end = 0
+
+    def _reserve_block(self, month_key):
+        counter_ref = self.db.collection(self.collection).document(month_key)
+
+        @firestore.transactional
+        def bump(txn):
+            snap = counter_ref.get(transaction=txn)
+            count = (snap.to_dict() or {}).get('count', 0) if snap.exists else 0
+            txn.set(counter_ref, {'count': count + self.block_size}, merge=True)
+            return count + 1, count + self.block_size
+
+        return bump(self.db.transaction())
+
+    def allocate(self, now=None):
+        now = now or datetime.utcnow()
+        month_key = now.strftime('%Y%m')
+        with self._lock:
+            if month_key != self._month_key or self._next > self._end:
+                self._next, self._end = self._reserve_block(month_key)
+                self._month_key = month_key
+            seq = self._next
+            self._next += 1
+        return f"{now.year:04d}/{now.month:02d}/{seq:02d}"
@@ -0,0 +1,175 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from firebase_admin import firestore
+from google.api_core.exceptions import AlreadyExists, FailedPrecondition
+
+# Workflow stage -> collection its route writes to
+SECTION_COLLECTIONS = {
+    'subjective':            'subjective_examination',
+    'perspectives':          'patient_perspectives',
+    'initial_plan':          'initial_plan',
+    'patho_mechanism':       'patho_mechanism',
+    'chronic_disease':       'chronic_diseases',
+    'clinical_flags':        'clinical_flags',
+    'objective_assessment':  'objective_assessments',
+    'provisional_diagnosis': 'provisional_diagnosis',
+    'smart_goals':           'smart_goals',
+    'treatment_plan':        'treatment_plan',
+    'follow_up':             'follow_ups',
+}
+
+REPORT_SECTIONS = ('subjective', 'perspectives', 'provisional_diagnosis',
+                   'smart_goals', 'treatment_plan')
+
+INITIAL_PLAN_SECTIONS = ['active_movements', 'passive_movements', 'passive_over_pressure',
+                         'resisted_movements', 'combined_movements', 'special_tests',
+                         'neuro_dynamic_examination']
+
+# Shared by every request in the worker; Firestore clients are thread-safe
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('FIRESTORE_FETCH_WORKERS', 16)),
+    thread_name_prefix='patient-record'
+)
+
+
+class PatientRecord:
+    """A patient document together with the latest entry of each workflow stage."""
+
+    def __init__(self, patient_id, patient, sections):
+        self.patient_id = patient_id
+        self.patient = patient
+        self.sections = sections
+
+    def __getitem__(self, name):
+        return self.sections.get(name) or {}
+
+    def assessment_plan(self):
+        """The initial plan reshaped to ``{section: {'choice', 'details'}}``."""
+        plan = self['initial_plan']
+        return {
+            s: {'choice': plan.get(s), 'details': plan.get(f"{s}_details", '')}
+            for s in INITIAL_PLAN_SECTIONS if s in plan
+        }
+
+    def fields(self, name):
+        """A stage's entered fields, without its bookkeeping keys."""
+        return {k: v for k, v in self[name].items() if k not in ('patient_id', 'timestamp')}
+
+    def context(self):
+        """
+        The ``previous`` dict the AI prompt builders take: patient basics plus
+        the saved subjective, perspectives and initial-plan stages.
+        """
+        return {
+            'age_sex': self.patient.get('age_sex', ''),
+            'present_history': self.patient.get('present_history', ''),
+            'past_history': self.patient.get('past_history', ''),
+            'subjective': self.fields('subjective'),
+            'perspectives': self.fields('perspectives'),
+            'assessments': self.assessment_plan(),
+        }
+
+
+def fetch_latest(db, collection, patient_id):
+    docs = db.collection(collection) \
+        .where('patient_id', '==', patient_id) \
+        .order_by('timestamp', direction=firestore.Query.DESCENDING) \
+        .limit(1).get()
+    return docs[0].to_dict() if docs else {}
+
+
+def fetch_patient_doc(db, patient_id):
+    doc = db.collection('patients').document(patient_id).get()
+    return doc.to_dict() if doc.exists else None
+
+
+# ─── PATIENT CASE AGGREGATE ─────────────────────────────────────────────
+# patient_cases/{patient_id} mirrors the patient document and the latest
+# entry of every stage, so a whole case is a single document read.
+# 'complete' marks cases that hold every stage saved so far; older
+# patients are backfilled from the stage collections on first load.
+
+def case_ref(db, patient_id):
+    return db.collection('patient_cases').document(patient_id)
+
+
+def create_case(batch, db, patient_id, patient):
+    batch.set(case_ref(db, patient_id), {
+        'patient_id': patient_id,
+        'patient': patient,
+        'complete': True,
+        'updated_at': firestore.SERVER_TIMESTAMP
+    })
+
+
+def save_stage(db, patient_id, stage, entry):
+    """Add a stage entry and mirror it onto the case document atomically."""
+    batch = db.batch()
+    batch.set(db.collection(SECTION_COLLECTIONS[stage]).document(), entry)
+    # field-path merge replaces the whole stage map rather than deep-merging it
+    batch.set(case_ref(db, patient_id), {
+        'patient_id': patient_id,
+        stage: entry,
+        'updated_at': firestore.SERVER_TIMESTAMP
+    }, merge=['patient_id', stage, 'updated_at'])
+    batch.commit()
+
+
+def update_patient(db, patient_id, updates):
+    """Update the patient document and its mirror on the case document."""
+    batch = db.batch()
+    batch.update(db.collection('patients').document(patient_id), updates)
+    batch.set(case_ref(db, patient_id),
+              {'patient': updates, 'updated_at': firestore.SERVER_TIMESTAMP},
+              merge=True)
+    batch.commit()
+
+
+def _load_from_collections(db, patient_id, sections):
+    patient_future = _executor.submit(fetch_patient_doc, db, patient_id)
+    section_futures = {
+        name: _executor.submit(fetch_latest, db, SECTION_COLLECTIONS[name], patient_id)
+        for name in sections
+    }
+    patient = patient_future.result()
+    return patient, {name: f.result() for name, f in section_futures.items()}
+
+
+def load_patient_record(db, patient_id, sections=tuple(SECTION_COLLECTIONS)):
+    """
+    Load a patient with the latest entry of each requested section.
+
+    Cases with a complete aggregate document cost one read. Otherwise the
+    patient document and every section are fetched concurrently (about one
+    round trip) and the aggregate is backfilled for next time.
+    Returns None when the patient does not exist.
+    """
+    case = case_ref(db, patient_id).get()
+    data = case.to_dict() if case.exists else {}
+    if data.get('complete') and data.get('patient'):
+        return PatientRecord(patient_id, data['patient'],
+                             {name: data.get(name) or {} for name in sections})
+
+    patient, results = _load_from_collections(db, patient_id, tuple(SECTION_COLLECTIONS))
+    if patient is None:
+        return None
+    aggregate = {
+        **results,
+        'patient_id': patient_id,
+        'patient': patient,
+        'complete': True,
+        'updated_at': firestore.SERVER_TIMESTAMP
+    }
+    # A save_stage that commits between the reads above and this write holds
+    # newer data, so the backfill only lands if the case doc is unchanged;
+    # otherwise it is skipped and the next load reads the collections again
+    try:
+        if case.exists:
+            case_ref(db, patient_id).update(
+                aggregate, option=db.write_option(last_update_time=case.update_time))
+        else:
+            case_ref(db, patient_id).create(aggregate)
+    except (AlreadyExists, FailedPrecondition):
+        pass
+    return PatientRecord(patient_id, patient, {name: results[name] for name in sections})
@@ -0,0 +1,153 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+
+from cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+def file_digest(*paths):
+    """Hash of the given files' contents, so a template change invalidates every report."""
+    h = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def report_etag(patient, sections, template_digest=''):
+    """Hash of everything a report shows; it changes whenever a stage is saved."""
+    raw = json.dumps({
+        'patient': patient,
+        'sections': sections,
+        'template': template_digest
+    }, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()[:32]
+
+
+class ReportCache:
+    """
+    Rendered report PDFs keyed on ``report_etag``.
+
+    Entries live in an in-process LRU and, when ``directory`` is set, also as
+    ``<etag>.pdf`` files there so every worker on the host can serve them.
+    Because the key is a content hash a stale PDF is never served; ``forget``
+    only frees the patient's superseded entry early.
+    """
+
+    def __init__(self, maxsize=64, ttl=86400, directory=None, prune_every=100):
+        self.ttl = ttl
+        self.directory = directory
+        self.prune_every = prune_every
+        self._memory = LRUCache(maxsize=maxsize, ttl=ttl)
+        self._latest = {}
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, etag):
+        return os.path.join(self.directory, f"{etag}.pdf")
+
+    def _read_file(self, etag):
+        path = self._path(etag)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                os.remove(path)
+                return None
+            with open(path, 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _write_file(self, etag, pdf):
+        path = self._path(etag)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            # created on the first write, not when the cache is built at import
+            os.makedirs(self.directory, exist_ok=True)
+            with open(tmp, 'wb') as f:
+                f.write(pdf)
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning(f"Could not write cached report {path}: {e}")
+
+    def _remove_file(self, etag):
+        try:
+            os.remove(self._path(etag))
+        except OSError:
+            pass
+
+    def _prune(self):
+        cutoff = time.time() - self.ttl
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        for name in names:
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def get(self, etag):
+        pdf = self._memory.get(etag)
+        if pdf is None and self.directory:
+            pdf = self._read_file(etag)
+            if pdf is not None:
+                self._memory.set(etag, pdf)
+        with self._lock:
+            if pdf is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return pdf
+
+    def set(self, patient_id, etag, pdf):
+        with self._lock:
+            previous = self._latest.get(patient_id)
+            self._latest[patient_id] = etag
+            self._writes += 1
+            prune = self.directory and self._writes % self.prune_every == 0
+        if previous and previous != etag:
+            self._drop(previous)
+        self._memory.set(etag, pdf)
+        if self.directory:
+            self._write_file(etag, pdf)
+            if prune:
+                self._prune()
+
+    def forget(self, patient_id):
+        with self._lock:
+            etag = self._latest.pop(patient_id, None)
+        if etag:
+            self._drop(etag)
+
+    def _drop(self, etag):
+        self._memory.delete(etag)
+        if self.directory:
+            self._remove_file(etag)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'backend': 'disk' if self.directory else 'memory',
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 3) if total else 0.0,
+            'size': len(self._memory)
+        }
+
+
+def report_cache_from_env():
+    """Build the report PDF cache from ``REPORT_CACHE_*`` environment variables."""
+    return ReportCache(
+        maxsize=int(os.environ.get('REPORT_CACHE_SIZE', 64)),
+        ttl=int(os.environ.get('REPORT_CACHE_TTL', 86400)),
+        directory=os.environ.get('REPORT_CACHE_DIR') or None)
@@ -0,0 +1,99 @@
+"""
+HTML-to-PDF rendering for the report download and the background jobs.
+
+    PDF_RENDERER=inline    pisa.CreatePDF in the request thread
+    PDF_RENDERER=process   in the job queue's process pool (see jobs.py)
+
+xhtml2pdf and reportlab are pure Python, so under gunicorn threads inline
+renders serialize on the GIL. The process renderer hands the HTML to a pool
+process and waits for the bytes. The pool starts on first use; under
+gunicorn, post_worker_init starts and warms it as each worker boots, so the
+first download doesn't pay for imports, font metrics and default CSS.
+Importing this module (or main.py) never starts a process.
+"""
+import io
+import os
+import logging
+
+from xhtml2pdf import pisa
+
+logger = logging.getLogger(__name__)
+
+# the fonts xhtml2pdf falls back to for the report's CSS
+WARM_FONTS = ('Helvetica', 'Helvetica-Bold', 'Helvetica-Oblique', 'Times-Roman', 'Courier')
+
+WARM_HTML = (
+    "<html><head><style>h2, h3 { color: #00695c; } p { margin: 8px 0; }</style></head>"
+    "<body><div class='container'><h2>Patient Report</h2><h3>Basic Info</h3>"
+    "<p><strong>Name:</strong> warm-up</p></div></body></html>"
+)
+
+
+class PDFRenderError(Exception):
+    pass
+
+
+def render_pdf(html):
+    """HTML to PDF bytes."""
+    out = io.BytesIO()
+    status = pisa.CreatePDF(io.StringIO(html), dest=out)
+    if status.err:
+        raise PDFRenderError(f"xhtml2pdf reported {status.err} error(s)")
+    return out.getvalue()
+
+
+def warm_up():
+    """Load font metrics and render one small report so later renders start hot."""
+    from reportlab.pdfbase import pdfmetrics
+
+    for name in WARM_FONTS:
+        pdfmetrics.getFont(name)
+    render_pdf(WARM_HTML)
+    return os.getpid()
+
+
+def init_worker(nice=0):
+    """Pool process initializer: lower the scheduling priority, then warm up."""
+    if nice:
+        try:
+            os.nice(nice)
+        except (AttributeError, OSError):
+            pass
+    try:
+        warm_up()
+    except Exception as e:
+        logger.warning(f"PDF renderer warm-up failed: {e}")
+
+
+class InlineRenderer:
+    name = 'inline'
+
+    def render(self, html):
+        return render_pdf(html)
+
+    def warm(self):
+        pass
+
+
+class ProcessRenderer:
+    """Renders in the job queue's process pool; the calling thread waits without holding the GIL."""
+    name = 'process'
+
+    def __init__(self, jobs, timeout=60.0):
+        self.jobs = jobs
+        self.timeout = timeout
+
+    def render(self, html):
+        return self.jobs.render(html).result(timeout=self.timeout)
+
+    def warm(self):
+        self.jobs.warm()
+
+
+def renderer_from_env(jobs):
+    kind = os.environ.get('PDF_RENDERER', 'inline').lower()
+    if kind == 'process':
+        return ProcessRenderer(jobs, timeout=float(os.environ.get('PDF_RENDER_TIMEOUT', 60)))
+    if kind != 'inline':
+        raise ValueError(f"Unknown PDF_RENDERER {kind!r}")
+    return InlineRenderer()
@@ -0,0 +1,97 @@
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class Prefetcher:
+    """
+    Warms the AI response cache for the page a clinician is about to open.
+
+    ``submit`` hands a prompt builder to a small pool and returns at once;
+    the builder runs in the background and each prompt it returns is sent
+    through ``fetch`` unless ``is_cached`` already has it. Work is shed, never
+    queued without bound: jobs beyond ``max_pending`` are dropped, each user
+    may spend at most ``per_user`` completions per ``window`` seconds, and
+    nothing runs while ``busy()`` says live requests need the capacity.
+    """
+
+    def __init__(self, fetch, is_cached, busy=lambda: False, max_workers=2,
+                 max_pending=32, per_user=30, window=3600.0):
+        self.fetch = fetch
+        self.is_cached = is_cached
+        self.busy = busy
+        self.max_pending = max_pending
+        self.per_user = per_user
+        self.window = window
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ai-prefetch')
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._spent = {}
+
+        self.submitted = 0
+        self.dropped = 0
+        self.warmed = 0
+        self.already_cached = 0
+        self.over_budget = 0
+        self.errors = 0
+
+    def _charge(self, user_id):
+        now = time.time()
+        with self._lock:
+            started, used = self._spent.get(user_id, (now, 0))
+            if now - started > self.window:
+                started, used = now, 0
+            if used >= self.per_user:
+                self.over_budget += 1
+                return False
+            self._spent[user_id] = (started, used + 1)
+            return True
+
+    def submit(self, user_id, build_prompts):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.dropped += 1
+                return False
+            self._pending += 1
+            self.submitted += 1
+        self._executor.submit(self._run, user_id, build_prompts)
+        return True
+
+    def _run(self, user_id, build_prompts):
+        try:
+            for prompt in build_prompts():
+                if self.busy():
+                    with self._lock:
+                        self.dropped += 1
+                    return
+                if self.is_cached(prompt):
+                    with self._lock:
+                        self.already_cached += 1
+                    continue
+                if not self._charge(user_id):
+                    return
+                self.fetch(prompt)
+                with self._lock:
+                    self.warmed += 1
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+            logger.info(f"AI prefetch abandoned: {e}")
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def metrics(self):
+        return {
+            'pending': self._pending,
+            'submitted': self.submitted,
+            'dropped': self.dropped,
+            'warmed': self.warmed,
+            'already_cached': self.already_cached,
+            'over_budget': self.over_budget,
+            'errors': self.errors
+        }
@@ -0,0 +1,141 @@
+import math
+import logging
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+_encoding = None
+
+
+def count_tokens(text):
+    """Token count via tiktoken when it is installed, else ~4 characters per token."""
+    global _encoding, tiktoken
+    if tiktoken is not None and _encoding is None:
+        try:
+            _encoding = tiktoken.get_encoding('cl100k_base')
+        except Exception as e:
+            # the BPE file is downloaded on first use; offline, fall back for good
+            logger.warning(f"tiktoken unavailable, estimating tokens from length: {e}")
+            tiktoken = None
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return math.ceil(len(text) / 4)
+
+
+def clip(text, max_tokens):
+    """``text`` cut at a word boundary so that, with its ' …' marker, it counts at most ``max_tokens``."""
+    if count_tokens(text) <= max_tokens:
+        return text
+    # cut points: every space, or every character for text without one
+    ends = [i for i, c in enumerate(text) if c == ' '] or list(range(1, len(text)))
+    lo, hi = 0, len(ends)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if count_tokens(text[:ends[mid]].rstrip(' ,;:') + ' …') <= max_tokens:
+            lo = mid + 1
+        else:
+            hi = mid
+    if not lo:
+        return '…'
+    return text[:ends[lo - 1]].rstrip(' ,;:') + ' …'
+
+
+class Section:
+    """``head`` + lines + ``tail``. Priority 0 is never cut; higher numbers are cut first."""
+
+    def __init__(self, head, lines=(), tail='', priority=0):
+        self.head = head
+        self.lines = list(lines)
+        self.tail = tail
+        self.priority = priority
+        self.dropped = False
+        self.recount()
+
+    def text(self):
+        if self.dropped:
+            return ''
+        return self.head + "\n".join(self.lines) + self.tail
+
+    def recount(self):
+        self.tokens = count_tokens(self.text())
+        return self.tokens
+
+
+class BudgetedPrompt:
+    """
+    Assembles a prompt from sections and keeps it within ``budget`` tokens.
+    Under budget the output is exactly the concatenated sections. Over budget,
+    the lowest-priority sections lose detail first, and only as much as the
+    excess: their longest lines are shortened to a common length, no lower
+    than ``line_cap`` tokens, just far enough to fit. Only if that is not
+    enough are trailing lines removed, then the section.
+    """
+
+    def __init__(self, name, budget, line_cap=150):
+        self.name = name
+        self.budget = budget
+        self.line_cap = line_cap
+        self.sections = []
+        self.tokens = 0
+
+    def add(self, text):
+        self.sections.append(Section(text))
+        return self
+
+    def add_section(self, head, lines, tail='', priority=1):
+        self.sections.append(Section(head, lines, tail, priority))
+        return self
+
+    def _total(self):
+        return sum(s.tokens for s in self.sections)
+
+    def _fit(self):
+        cuttable = sorted((s for s in self.sections if s.priority),
+                          key=lambda s: s.priority, reverse=True)
+
+        for s in cuttable:
+            if self._total() <= self.budget:
+                return
+            self._shorten(s)
+
+        for s in cuttable:
+            while self._total() > self.budget and s.lines:
+                s.lines.pop()
+                s.recount()
+            if self._total() > self.budget:
+                s.dropped = True
+                s.recount()
+
+    def _clip_lines(self, section, lines, cap):
+        section.lines = [clip(line, cap) for line in lines]
+        section.recount()
+        return self._total() <= self.budget
+
+    def _shorten(self, section):
+        """Clip ``section``'s lines to the longest length that fits, or to ``line_cap`` if none does."""
+        lines = list(section.lines)
+        longest = max(map(count_tokens, lines), default=0)
+        if longest <= self.line_cap or not self._clip_lines(section, lines, self.line_cap):
+            return
+        # line_cap fits and longest doesn't: search for the largest cap that fits
+        lo, hi = self.line_cap, longest - 1
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if self._clip_lines(section, lines, mid):
+                lo = mid
+            else:
+                hi = mid - 1
+        self._clip_lines(section, lines, lo)
+
+    def render(self):
+        before = self._total()
+        if before > self.budget:
+            self._fit()
+            logger.info(f"Prompt '{self.name}' trimmed from ~{before} to ~{self._total()} tokens "
+                        f"(budget {self.budget})")
+        self.tokens = self._total()
+        return ''.join(s.text() for s in self.sections)
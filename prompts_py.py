@@ -1,3 +1,64 @@
+import json
+from functools import lru_cache
+
+from prompt_budget import BudgetedPrompt
+
+# Upper bound on prompt tokens per template; long free text is trimmed to fit
+PROMPT_TOKEN_BUDGETS = {
+    'smart_goals': 1200,
+    'treatment_summary': 2500,
+}
+
+PROMPT_TEMPLATES = {}
+
+
+def template(name):
+    """Register a prompt builder under ``name`` (see bench_prompts.py)."""
+    def register(fn):
+        PROMPT_TEMPLATES[name] = fn
+        return fn
+    return register
+
+
+# Every builder that lists a stage's fields renders the same blocks; on one
+# page the per-field requests repeat them with identical content, so the
+# rendered text is memoized on the (field, value) pairs themselves.
+@lru_cache(maxsize=4096)
+def _label(key):
+    return key.replace('_', ' ').title()
+
+
+@lru_cache(maxsize=2048)
+def _render_lines(items):
+    return "\n".join(f"- {_label(k)}: {v}" for k, v in items)
+
+
+def _lines(items):
+    try:
+        return _render_lines(items)
+    except TypeError:
+        # unhashable values (nested dicts) are rendered without the cache
+        return _render_lines.__wrapped__(items)
+
+
+def _findings(section, exclude=None):
+    """'- Field Name: value' for each filled-in field of a stage."""
+    return _lines(tuple((k, v) for k, v in section.items() if k != exclude and v))
+
+
+def assessment_text(entry):
+    """An initial-plan entry as 'choice (details: ...)'."""
+    details = entry.get('details')
+    return f"{entry.get('choice')} (details: {details})" if details else str(entry.get('choice'))
+
+
+def _assessment_lines(assessments, raw=False):
+    """'- Field Name: choice' (or the whole entry with ``raw``) for each assessed field."""
+    return _lines(tuple((k, str(v) if raw else v.get('choice'))
+                        for k, v in assessments.items() if v and v.get('choice')))
+
+
+@template('history_questions')
 def generate_history_questions_prompt(age_sex: str, present_history: str) -> str:
     return (
         "You are a physiotherapy clinical decision-support assistant. "
@@ -10,6 +71,7 @@ def generate_history_questions_prompt(age_sex: str, present_history: str) -> str
         "Format as a numbered list."
     )
 
+@template('diagnosis')
 def generate_diagnosis_prompt(age_sex: str, present_history: str, past_history: str) -> str:
     return (
         "You are a physiotherapy clinical decision-support assistant. "
@@ -22,12 +84,9 @@ def generate_diagnosis_prompt(age_sex: str, present_history: str, past_history:
         "Format each as a numbered item."
     )
 
+@template('subjective_field')
 def generate_subjective_field_prompt(age_sex: str, present_history: str, past_history: str, inputs: dict, field: str) -> str:
-    subjective_lines = "\n".join(
-        f"- {k.replace('_', ' ').title()}: {v}"
-        for k, v in inputs.items()
-        if k != field and v
-    )
+    subjective_lines = _findings(inputs, exclude=field)
     return (
         "You're a physiotherapy clinical decision-support assistant. Exclude all identifiers.\n"
         "Patient info:\n"
@@ -36,16 +95,13 @@ def generate_subjective_field_prompt(age_sex: str, present_history: str, past_hi
         f"- Past history: {past_history}\n\n"
         "Subjective findings so far:\n"
         f"{subjective_lines}\n\n"
-        f"For **{field.replace('_', ' ').title()}**, provide **2 – 3 concise, open-ended questions** to explore this area further (align with WHO ICF)."
+        f"For **{_label(field)}**, provide **2 – 3 concise, open-ended questions** to explore this area further (align with WHO ICF)."
     )
 
 
+@template('subjective_diagnosis')
 def generate_subjective_diagnosis_prompt(age_sex: str, present_history: str, past_history: str, inputs: dict) -> str:
-    findings = "\n".join(
-        f"- {k.replace('_', ' ').title()}: {v}"
-        for k, v in inputs.items()
-        if v
-    )
+    findings = _findings(inputs)
     return (
         "You're a physiotherapy clinical decision-support assistant. Exclude all identifiers.\n"
         "Patient info:\n"
@@ -57,6 +113,33 @@ def generate_subjective_diagnosis_prompt(age_sex: str, present_history: str, pas
         "List up to **2 provisional diagnoses** with a **one-sentence rationale** each. Format as a numbered list."
     )
 
+def _prefill_reply_format(fields) -> str:
+    template = json.dumps({f: "1. ...\n2. ..." for f in fields})
+    return (
+        "Reply with only a JSON object of this shape, each value a numbered list in a single string:\n"
+        f"{template}"
+    )
+
+
+@template('subjective_prefill')
+def generate_subjective_prefill_prompt(age_sex: str, present_history: str, past_history: str, inputs: dict, fields) -> str:
+    findings = _findings(inputs)
+    areas = "\n".join(f"- {_label(f)}" for f in fields)
+    return (
+        "You're a physiotherapy clinical decision-support assistant. Exclude all identifiers.\n"
+        "Patient info:\n"
+        f"- Age/Sex: {age_sex}\n"
+        f"- Present history: {present_history}\n"
+        f"- Past history: {past_history}\n\n"
+        "Subjective findings so far:\n"
+        f"{findings}\n\n"
+        "For each area below, provide **2 – 3 concise, open-ended questions** to explore it further (align with WHO ICF):\n"
+        f"{areas}\n\n" +
+        _prefill_reply_format(fields)
+    )
+
+
+@template('perspectives_field')
 def generate_perspectives_field_prompt(previous, inputs, field):
     age_sex = previous.get('age_sex', '')
     present = previous.get('present_history', '')
@@ -71,15 +154,16 @@ def generate_perspectives_field_prompt(previous, inputs, field):
         f"- Present history: {present}\n"
         f"- Past history: {past}\n\n"
         "Subjective findings:\n" +
-        "\n".join(f"- {k.replace('_', ' ').title()}: {v}" for k, v in subj.items() if v) +
+        _findings(subj) +
         "\n\nPatient perspectives recorded so far:\n" +
-        "\n".join(f"- {k.replace('_', ' ').title()}: {v}" for k, v in perspectives.items() if k != field and v) +
-        f"\n\nFor **{field.replace('_', ' ').title()}**, suggest **2–3 concise, open-ended questions** a physiotherapist can ask to explore this area deeper. "
+        _findings(perspectives, exclude=field) +
+        f"\n\nFor **{_label(field)}**, suggest **2–3 concise, open-ended questions** a physiotherapist can ask to explore this area deeper. "
         "Format as a numbered list."
     )
     return prompt
 
 
+@template('perspectives_diagnosis')
 def generate_perspectives_diagnosis_prompt(previous, inputs):
     age_sex = previous.get('age_sex', '')
     present = previous.get('present_history', '')
@@ -94,14 +178,39 @@ def generate_perspectives_diagnosis_prompt(previous, inputs):
         f"- Present history: {present}\n"
         f"- Past history: {past}\n\n"
         "Subjective findings:\n" +
-        "\n".join(f"- {k.replace('_', ' ').title()}: {v}" for k, v in subj.items() if v) +
+        _findings(subj) +
         "\n\nPatient perspectives:\n" +
-        "\n".join(f"- {k.replace('_', ' ').title()}: {v}" for k, v in persps.items() if v) +
+        _findings(persps) +
         "\nProvide up to **2 provisional clinical impressions** (**1–2 sentences each**), integrating these perspectives. "
         "Number each item."
     )
     return prompt
 
+@template('perspectives_prefill')
+def generate_perspectives_prefill_prompt(previous, inputs, fields):
+    age_sex = previous.get('age_sex', '')
+    present = previous.get('present_history', '')
+    past = previous.get('past_history', '')
+    subj = previous.get('subjective', {})
+    perspectives = {**previous.get('perspectives', {}), **inputs}
+
+    prompt = (
+        "You are a physiotherapy clinical decision-support assistant. Exclude any identifiers.\n"
+        "Patient summary:\n"
+        f"- Age/Sex: {age_sex}\n"
+        f"- Present history: {present}\n"
+        f"- Past history: {past}\n\n"
+        "Subjective findings:\n" +
+        _findings(subj) +
+        "\n\nPatient perspectives recorded so far:\n" +
+        _findings(perspectives) +
+        "\n\nFor each area below, suggest **2–3 concise, open-ended questions** a physiotherapist can ask to explore it deeper:\n" +
+        "\n".join(f"- {_label(f)}" for f in fields) +
+        "\n\n" + _prefill_reply_format(fields)
+    )
+    return prompt
+
+@template('initial_plan')
 def generate_initial_plan_prompt(prev, field, selection):
     prompt = (
         "You are a PHI-safe clinical assessment assistant. Use WHO-ICF and physiotherapy best practices.\n\n"
@@ -110,10 +219,10 @@ def generate_initial_plan_prompt(prev, field, selection):
         f"- Present history: {prev.get('present_history', '')}\n"
         f"- Past history: {prev.get('past_history', '')}\n\n"
         "Subjective findings:\n" +
-        "\n".join(f"- {k.replace('_', ' ').title()}: {v}" for k, v in prev.get('subjective', {}).items() if v) +
+        _findings(prev.get('subjective', {})) +
         "\n\nPerspectives:\n" +
-        "\n".join(f"- {k.replace('_', ' ').title()}: {v}" for k, v in prev.get('perspectives', {}).items() if v) +
-        f"\n\nThe therapist marked **{field.replace('_', ' ').title()}** as **{selection}**. "
+        _findings(prev.get('perspectives', {})) +
+        f"\n\nThe therapist marked **{_label(field)}** as **{selection}**. "
         "Interpret **Mandatory assessment** as essential tests, **Assessment with precaution** as tests requiring caution, "
         "and **Absolutely Contraindicated** as tests to avoid. "
         "List **2-4** specific tests or maneuvers matching this category as a bullet list."
@@ -121,6 +230,7 @@ def generate_initial_plan_prompt(prev, field, selection):
     return prompt
 
 
+@template('initial_plan_summary')
 def generate_initial_plan_summary_prompt(prev, assessments):
     prompt = (
         "You are a PHI-safe clinical summarizer.\n\n"
@@ -129,18 +239,19 @@ def generate_initial_plan_summary_prompt(prev, assessments):
         f"- Present history: {prev.get('present_history', '')}\n"
         f"- Past history: {prev.get('past_history', '')}\n\n"
         "Subjective findings:\n" +
-        "\n".join(f"- {k.replace('_', ' ').title()}: {v}" for k, v in prev.get('subjective', {}).items() if v) +
+        _findings(prev.get('subjective', {})) +
         "\n\nPerspectives:\n" +
-        "\n".join(f"- {k.replace('_', ' ').title()}: {v}" for k, v in prev.get('perspectives', {}).items() if v) +
+        _findings(prev.get('perspectives', {})) +
         "\n\nAssessment plan:\n" +
         "\n".join(
-            f"- {k.replace('_', ' ').title()}: {assessments[k]['choice']} ({assessments[k]['details']})"
+            f"- {_label(k)}: {assessments[k]['choice']} ({assessments[k]['details']})"
             for k in assessments
         ) +
         "\n\nProvide a concise 2-3 sentence summary of the assessment findings and up to two provisional diagnoses."
     )
     return prompt
 
+@template('patho_possible_source')
 def generate_patho_possible_source_prompt(prev, selection):
     prompt = (
         "You are a PHI-safe clinical reasoning assistant. Integrate all collected patient data: "
@@ -151,17 +262,18 @@ def generate_patho_possible_source_prompt(prev, selection):
         f"- Present history: {prev.get('present_history', '')}\n"
         f"- Past history: {prev.get('past_history', '')}\n\n"
         "Subjective findings:\n" +
-        "\n".join(f"- {k.replace('_', ' ').title()}: {v}" for k, v in prev.get('subjective', {}).items() if v) +
+        _findings(prev.get('subjective', {})) +
         "\n\nPerspectives:\n" +
-        "\n".join(f"- {k.replace('_', ' ').title()}: {v}" for k, v in prev.get('perspectives', {}).items() if v) +
+        _findings(prev.get('perspectives', {})) +
         "\n\nAssessment plan:\n" +
-        "\n".join(f"- {k.replace('_', ' ').title()}: {v}" for k, v in prev.get('assessments', {}).items() if v and v.get('choice')) +
+        _assessment_lines(prev.get('assessments', {}), raw=True) +
         f"\n\nThe clinician marked **Possible Source of Symptoms** as **{selection}**. "
         "Describe 2-3 concise, plausible anatomical or physiological mechanisms explaining how this source produces the patient's symptoms. "
         "Format as a numbered list."
     )
     return prompt
 
+@template('chronic_factors')
 def generate_chronic_factors_prompt(prev, text_input, causes_selected):
     causes_text = (
         "\n".join(f"- {c}" for c in causes_selected) if causes_selected else "- None"
@@ -173,17 +285,18 @@ def generate_chronic_factors_prompt(prev, text_input, causes_selected):
         f"- Present history: {prev.get('present_history', '')}\n"
         f"- Past history: {prev.get('past_history', '')}\n\n"
         "Subjective findings:\n" +
-        "\n".join(f"- {k.replace('_', ' ').title()}: {v}" for k, v in prev.get('subjective', {}).items() if v) +
+        _findings(prev.get('subjective', {})) +
         "\n\nPerspectives:\n" +
-        "\n".join(f"- {k.replace('_', ' ').title()}: {v}" for k, v in prev.get('perspectives', {}).items() if v) +
+        _findings(prev.get('perspectives', {})) +
         "\n\nAssessment plan:\n" +
-        "\n".join(f"- {k.replace('_', ' ').title()}: {v.get('choice')}" for k, v in prev.get('assessments', {}).items() if v.get('choice')) +
+        _assessment_lines(prev.get('assessments', {})) +
         "\n\nThe clinician indicated these maintenance causes:\n" + causes_text +
         f"\n\nSpecific factors described: {text_input}\n\n"
         "What 3-5 directed, open-ended questions should the physiotherapist ask to clarify these chronic contributing factors?"
     )
     return prompt
 
+@template('clinical_flags')
 def generate_clinical_flags_prompt(prev, field, text):
     relevancy_hints = []
     if prev.get('subjective', {}).get('pain_irritability') == 'Present':
@@ -205,11 +318,12 @@ def generate_clinical_flags_prompt(prev, field, text):
         + "\n".join(f"- {k.title()}: {v.get('choice')}" for k, v in prev.get('assessments', {}).items() if v.get('choice')) +
         "\n\nRelevant flags to consider (based on above):\n"
         + "\n".join(f"- {h}" for h in relevancy_hints or ["- General flags"]) +
-        f"\n\nYou are focusing on **{field.replace('_', ' ').title()}** where the clinician noted:\n{text}\n\n"
+        f"\n\nYou are focusing on **{_label(field)}** where the clinician noted:\n{text}\n\n"
         "List 3–5 open-ended follow-up questions a physiotherapist should ask to probe this flag."
     )
     return prompt
 
+@template('objective_assessment')
 def generate_objective_assessment_prompt(patient_id, field, choice):
     prompt = (
         f"A physio is filling out an objective assessment for patient {patient_id}. "
@@ -218,6 +332,7 @@ def generate_objective_assessment_prompt(patient_id, field, choice):
     )
     return prompt
 
+@template('objective_field')
 def generate_objective_field_prompt(patient_id, field, choice):
     prompt = (
         f"A physiotherapist is filling out an objective assessment for patient {patient_id}. "
@@ -227,6 +342,7 @@ def generate_objective_field_prompt(patient_id, field, choice):
     return prompt
 
 
+@template('provisional_diagnosis')
 def generate_provisional_diagnosis_prompt(patient_id, field, patient):
     prompts = {
         'likelihood': f"Given all prior data for patient {patient_id}, suggest how likely diagnoses should be phrased.",
@@ -241,6 +357,7 @@ def generate_provisional_diagnosis_prompt(patient_id, field, patient):
 
 
 
+@template('smart_goals')
 def generate_smart_goals_prompt(field, prev, text):
     prompts = {
         'patient_goal': "Based on the patient’s entire record, suggest 2–3 patient-centric SMART goals they could aim for.",
@@ -249,20 +366,19 @@ def generate_smart_goals_prompt(field, prev, text):
         'time_duration': "What realistic time duration (e.g. weeks or months) fits those outcomes given the patient's condition?"
     }
 
-    base_prompt = prompts.get(field, f"You are a PHI-safe physiotherapy assistant. Help with field '{field}'.")
+    prompt = BudgetedPrompt('smart_goals', PROMPT_TOKEN_BUDGETS['smart_goals'])
+    prompt.add(prompts.get(field, f"You are a PHI-safe physiotherapy assistant. Help with field '{field}'."))
 
-    context_lines = []
-    for k, v in prev.items():
-        if v:
-            context_lines.append(f"- {k}: {v}")
+    context_lines = [f"- {k}: {v}" for k, v in prev.items() if v]
     if context_lines:
-        base_prompt += "\n\nPatient context:\n" + "\n".join(context_lines)
+        prompt.add_section("\n\nPatient context:\n", context_lines, priority=2)
 
     if text:
-        base_prompt += f"\n\nCurrent input: {text}"
+        prompt.add_section("\n\nCurrent input: ", [text], priority=1)
 
-    return base_prompt
+    return prompt.render()
 
+@template('treatment_plan')
 def generate_treatment_plan_prompt(field, text_input):
     prompts = {
         'treatment_plan': "Based on this patient's case, outline 3–4 evidence-based interventions you would include in the treatment plan.",
@@ -282,48 +398,44 @@ def generate_treatment_plan_prompt(field, text_input):
     return prompt
 
 
+def _entry_lines(entry):
+    return [f"- {k}: {v}" for k, v in entry.items() if k not in ('patient_id', 'timestamp')]
+
+
+@template('treatment_summary')
 def generate_treatment_summary_prompt(patient_info, subj, persp, assess, patho, chronic, flags, objective, prov_dx, goals, tx_plan):
-    prompt = (
+    # Priorities: the plan and goals being summarised are kept longest, the
+    # initial assessment plan is the first to be trimmed
+    prompt = BudgetedPrompt('treatment_summary', PROMPT_TOKEN_BUDGETS['treatment_summary'])
+    prompt.add(
         "You are a PHI-safe clinical summarization assistant.\n\n"
         f"Patient demographics: {patient_info.get('age_sex', 'N/A')}; "
         f"Sex: {patient_info.get('sex', 'N/A')}.\n"
-        f"Past medical history: {patient_info.get('past_history', 'N/A')}.\n\n"
-
-        "Subjective examination:\n"
-        + "\n".join(f"- {k}: {v}" for k, v in subj.items() if k not in ('patient_id', 'timestamp')) + "\n\n"
-
-        "Patient perspectives (ICF model):\n"
-        + "\n".join(f"- {k}: {v}" for k, v in persp.items() if k not in ('patient_id', 'timestamp')) + "\n\n"
-
-        "Initial plan of assessment:\n"
-        + "\n".join(
-            f"- {k}: {v.get('choice')} (details: {v.get('details', '')})"
-            for k, v in assess.items() if k not in ('patient_id', 'timestamp')
-        ) + "\n\n"
-
-        "Pathophysiological mechanism:\n"
-        + "\n".join(f"- {k}: {v}" for k, v in patho.items() if k not in ('patient_id', 'timestamp')) + "\n\n"
-
-        "Chronic disease factors:\n"
-        f"- Maintenance causes: {chronic.get('maintenance_causes', '')}\n"
-        f"- Specific factors: {chronic.get('specific_factors', '')}\n\n"
-
-        "Clinical flags:\n"
-        + "\n".join(f"- {k}: {v}" for k, v in flags.items() if k not in ('patient_id', 'timestamp')) + "\n\n"
-
-        "Objective assessment:\n"
-        + "\n".join(f"- {k}: {v}" for k, v in objective.items() if k not in ('patient_id', 'timestamp')) + "\n\n"
-
-        "SMART goals:\n"
-        + "\n".join(f"- {k}: {v}" for k, v in goals.items() if k not in ('patient_id', 'timestamp')) + "\n\n"
-
-        "Finally, the treatment plan:\n"
-        + "\n".join(f"- {k}: {v}" for k, v in tx_plan.items() if k not in ('patient_id', 'timestamp')) + "\n\n"
-
+    )
+    prompt.add_section("Past medical history: ", [str(patient_info.get('past_history', 'N/A'))], ".\n\n", priority=2)
+    prompt.add_section("Subjective examination:\n", _entry_lines(subj), "\n\n", priority=3)
+    prompt.add_section("Patient perspectives (ICF model):\n", _entry_lines(persp), "\n\n", priority=4)
+    prompt.add_section(
+        "Initial plan of assessment:\n",
+        [f"- {k}: {assessment_text(v)}"
+         for k, v in assess.items() if k not in ('patient_id', 'timestamp')],
+        "\n\n", priority=5)
+    prompt.add_section("Pathophysiological mechanism:\n", _entry_lines(patho), "\n\n", priority=4)
+    prompt.add_section(
+        "Chronic disease factors:\n",
+        [f"- Maintenance causes: {chronic.get('maintenance_causes') or chronic.get('causes', '')}",
+         f"- Specific factors: {chronic.get('specific_factors', '')}"],
+        "\n\n", priority=4)
+    prompt.add_section("Clinical flags:\n", _entry_lines(flags), "\n\n", priority=3)
+    prompt.add_section("Objective assessment:\n", _entry_lines(objective), "\n\n", priority=3)
+    prompt.add_section("SMART goals:\n", _entry_lines(goals), "\n\n", priority=2)
+    prompt.add_section("Finally, the treatment plan:\n", _entry_lines(tx_plan), "\n\n", priority=1)
+    prompt.add(
         "Using all of the above, create a **concise treatment plan summary** that links the patient's history, exam findings, goals, and interventions into a coherent paragraph."
     )
-    return prompt
+    return prompt.render()
 
+@template('followup')
 def generate_followup_prompt(patient, session_no, session_date, grade, perception, feedback, patient_id):
     case_summary_lines = [
         f"Age/Sex: {patient.get('age_sex', 'N/A')}",
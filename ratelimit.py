@@ -0,0 +1,190 @@
+import os
+import time
+import sqlite3
+import threading
+
+
+class RateLimitTimeout(Exception):
+    """Raised when a call could not be admitted before its deadline."""
+
+
+def _refill(level, updated, now, capacity, per_second):
+    return min(capacity, level + (now - updated) * per_second)
+
+
+class AIRateLimiter:
+    """
+    Token-bucket limiter for OpenAI calls, budgeting both requests/min and
+    tokens/min. Calls over budget wait in line until their deadline.
+
+    The line is first come, first served: each call takes a ticket, and only
+    the call at the head draws from the buckets, sleeping until its cost has
+    refilled. A large call therefore can't be starved by a stream of small
+    ones that fit sooner; the calls behind it wait their turn.
+
+    With ``state_path`` the buckets live in a SQLite file, so every gunicorn
+    worker on the host draws from the same budget. The order is kept within
+    each worker; the heads of the workers' lines compete for the buckets.
+    """
+
+    def __init__(self, requests_per_min=60, tokens_per_min=40000, max_wait=10.0, state_path=None):
+        self.limits = {
+            'requests': (float(requests_per_min), requests_per_min / 60.0),
+            'tokens': (float(tokens_per_min), tokens_per_min / 60.0),
+        }
+        self.max_wait = max_wait
+        self.state_path = state_path
+
+        now = time.time()
+        self._state = {name: (capacity, now) for name, (capacity, _) in self.limits.items()}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+        self._turn = threading.Condition()
+        self._next_ticket = 0
+        self._serving = 0
+        self._abandoned = set()
+
+        self._stats_lock = threading.Lock()
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.admitted = 0
+        self.timed_out = 0
+        self._total_wait = 0.0
+        self.max_wait_seen = 0.0
+
+    def _take(self, state, cost, now):
+        """Return (new_state, seconds to wait); the state only changes when admitted."""
+        levels = {}
+        wait = 0.0
+        for name, (capacity, per_second) in self.limits.items():
+            level, updated = state[name]
+            level = _refill(level, updated, now, capacity, per_second)
+            levels[name] = level
+            need = min(cost[name], capacity)
+            if level < need:
+                wait = max(wait, (need - level) / per_second)
+        if wait:
+            return state, wait
+        return {name: (levels[name] - min(cost[name], self.limits[name][0]), now)
+                for name in self.limits}, 0.0
+
+    def _try_local(self, cost):
+        with self._lock:
+            self._state, wait = self._take(self._state, cost, time.time())
+        return wait
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.state_path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS buckets ('
+                         'name TEXT PRIMARY KEY, level REAL NOT NULL, updated REAL NOT NULL)')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _try_shared(self, cost):
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            now = time.time()
+            rows = dict((name, (level, updated)) for name, level, updated
+                        in conn.execute('SELECT name, level, updated FROM buckets'))
+            state = {name: rows.get(name, (capacity, now))
+                     for name, (capacity, _) in self.limits.items()}
+            new_state, wait = self._take(state, cost, now)
+            if not wait:
+                conn.executemany('INSERT OR REPLACE INTO buckets (name, level, updated) VALUES (?, ?, ?)',
+                                 [(name, level, updated) for name, (level, updated) in new_state.items()])
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return wait
+
+    def _advance(self):
+        """Pass the head of the line to the next ticket still waiting."""
+        with self._turn:
+            self._serving += 1
+            while self._serving in self._abandoned:
+                self._abandoned.remove(self._serving)
+                self._serving += 1
+            self._turn.notify_all()
+
+    def _timeout(self):
+        with self._stats_lock:
+            self.timed_out += 1
+        return RateLimitTimeout(f"AI request could not be admitted within {self.max_wait:.0f}s")
+
+    def acquire(self, tokens, deadline=None):
+        """Block until one request and ``tokens`` tokens are available, in arrival order."""
+        deadline = deadline or time.time() + self.max_wait
+        cost = {'requests': 1, 'tokens': tokens}
+        try_take = self._try_shared if self.state_path else self._try_local
+        started = time.time()
+        queued = False
+
+        try:
+            with self._turn:
+                ticket = self._next_ticket
+                self._next_ticket += 1
+                while self._serving != ticket:
+                    if not queued:
+                        queued = self._enqueue()
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        # _advance skips it when the line reaches it
+                        self._abandoned.add(ticket)
+                        raise self._timeout()
+                    self._turn.wait(remaining)
+
+            try:
+                wait = try_take(cost)
+                while wait:
+                    if not queued:
+                        queued = self._enqueue()
+                    if time.time() + wait > deadline:
+                        raise self._timeout()
+                    time.sleep(wait)
+                    wait = try_take(cost)
+            finally:
+                self._advance()
+        finally:
+            if queued:
+                with self._stats_lock:
+                    self.queue_depth -= 1
+
+        waited = time.time() - started
+        with self._stats_lock:
+            self.admitted += 1
+            self._total_wait += waited
+            self.max_wait_seen = max(self.max_wait_seen, waited)
+        return waited
+
+    def _enqueue(self):
+        with self._stats_lock:
+            self.queue_depth += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        return True
+
+    def metrics(self):
+        return {
+            'shared': bool(self.state_path),
+            'queue_depth': self.queue_depth,
+            'max_queue_depth': self.max_queue_depth,
+            'admitted': self.admitted,
+            'timed_out': self.timed_out,
+            'avg_wait_ms': round(self._total_wait / self.admitted * 1000, 1) if self.admitted else 0.0,
+            'max_wait_ms': round(self.max_wait_seen * 1000, 1)
+        }
+
+
+def limiter_from_env():
+    return AIRateLimiter(
+        requests_per_min=int(os.environ.get('AI_REQUESTS_PER_MIN', 60)),
+        tokens_per_min=int(os.environ.get('AI_TOKENS_PER_MIN', 40000)),
+        max_wait=float(os.environ.get('AI_QUEUE_TIMEOUT', 10)),
+        state_path=os.environ.get('AI_RATE_LIMIT_STATE') or None
+    )
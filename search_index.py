@@ -0,0 +1,145 @@
+"""
+Case-insensitive patient search over name, patient ID and contact.
+
+Every patient document carries a ``search_terms`` array, written by
+add_patient/edit_patient: the normalized words of those fields, their one-
+and two-character prefixes and every trigram. A query is narrowed in
+Firestore with a single ``array_contains`` on one of its terms, and the
+candidates are confirmed in Python with a plain substring test:
+
+    "sharma"     -> array_contains 'sha', then 'sharma' in "anita k sharma ..."
+    "2025/07"    -> array_contains '202', then '2025' and '07' both present
+    "98765 432"  -> array_contains '987', digits of the contact run together
+
+Queries shorter than three characters can only match the start of a word.
+Patients written before this field existed are found once backfilled:
+
+    python search_index.py backfill
+
+The same pass gives patients without ``created_at`` their document's
+creation time. The patient list is ordered on that field, and Firestore
+leaves documents that lack it out of the ordered query entirely.
+"""
+import re
+import logging
+import argparse
+import unicodedata
+
+logger = logging.getLogger(__name__)
+
+SEARCH_FIELD = 'search_terms'
+
+# current field name first, then the legacy name it falls back to
+SEARCHABLE_FIELDS = (('name',), ('patient_id',), ('contact', 'contactDetails'))
+
+_NON_ALNUM = re.compile(r'[^0-9a-z]+')
+
+
+def normalize(text):
+    """Lower-case, accent-free words separated by single spaces."""
+    text = unicodedata.normalize('NFKD', str(text or ''))
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return _NON_ALNUM.sub(' ', text.casefold()).strip()
+
+
+def _field_values(patient):
+    for names in SEARCHABLE_FIELDS:
+        value = next((patient.get(n) for n in names if patient.get(n)), '')
+        yield normalize(value)
+
+
+def search_text(patient):
+    """The normalized text a query is matched against."""
+    values = list(_field_values(patient))
+    # phone numbers are typed with and without spaces or dashes
+    values.append(values[-1].replace(' ', ''))
+    return ' | '.join(values)
+
+
+def search_terms(patient):
+    """Sorted terms stored in ``search_terms`` for ``patient``."""
+    words = set(search_text(patient).replace('|', ' ').split())
+    terms = set()
+    for word in words:
+        terms.add(word)
+        terms.update(word[:n] for n in (1, 2))
+        terms.update(word[i:i + 3] for i in range(len(word) - 2))
+    return sorted(terms)
+
+
+def query_words(query):
+    return normalize(query).split()
+
+
+def query_term(query):
+    """The stored term every match for ``query`` must carry, or None for an empty query."""
+    words = query_words(query)
+    if not words:
+        return None
+    longest = max(words, key=len)
+    return longest[:3]
+
+
+def matches(patient, query):
+    """True when every word of ``query`` occurs in the patient's name, ID or contact."""
+    text = search_text(patient)
+    return all(word in text for word in query_words(query))
+
+
+def backfill(db, page_size=200):
+    """
+    Write ``search_terms`` onto every patient document that lacks or has a
+    stale copy, and ``created_at`` onto those without one.
+    """
+    from patient_record import case_ref
+
+    updated = scanned = 0
+    query = db.collection('patients').order_by('__name__').limit(page_size)
+    last = None
+    while True:
+        page = list((query.start_after(last) if last else query).stream())
+        if not page:
+            break
+        batch = db.batch()
+        writes = 0
+        for doc in page:
+            scanned += 1
+            patient = doc.to_dict()
+            terms = search_terms({**patient, 'patient_id': patient.get('patient_id') or doc.id})
+            updates = {}
+            if patient.get(SEARCH_FIELD) != terms:
+                updates[SEARCH_FIELD] = terms
+            if patient.get('created_at') is None:
+                updates['created_at'] = doc.create_time
+            if not updates:
+                continue
+            batch.update(doc.reference, updates)
+            # keep the case aggregate's copy of the patient in step
+            pid = patient.get('patient_id')
+            if pid and SEARCH_FIELD in updates:
+                batch.set(case_ref(db, pid), {'patient': {SEARCH_FIELD: terms}}, merge=True)
+                writes += 1
+            writes += 1
+        if writes:
+            batch.commit()
+            updated += writes
+        last = page[-1]
+        logger.info(f"Search backfill: {scanned} patients scanned, {updated} writes")
+    return scanned, updated
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Patient search index maintenance')
+    parser.add_argument('command', choices=['backfill'])
+    parser.add_argument('--page-size', type=int, default=200,
+                        help='patients per batch (two writes each, at most 250)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    from clients import db
+    scanned, writes = backfill(db, min(args.page_size, 250))
+    print(f"Scanned {scanned} patients, {writes} writes")
+
+
+if __name__ == '__main__':
+    main()
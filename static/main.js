@@ -1,3 +1,60 @@
+// Stream an AI suggestion as Server-Sent Events, calling onText with the text
+// received so far. Falls back to the plain JSON reply when the server sends one.
+async function streamSuggestion(url, options = {}, onText = () => {}) {
+    const res = await fetch(url, {
+        ...options,
+        headers: { ...(options.headers || {}), 'Accept': 'text/event-stream' }
+    });
+
+    if (!(res.headers.get('Content-Type') || '').includes('text/event-stream')) {
+        const data = await res.json();
+        if (data.error) throw new Error(data.error);
+        const text = data.suggestion || data.summary || data.suggestions || '';
+        onText(text);
+        return text;
+    }
+
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let text = '';
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        let sep;
+        while ((sep = buffer.indexOf('\n\n')) !== -1) {
+            const raw = buffer.slice(0, sep);
+            buffer = buffer.slice(sep + 2);
+
+            let event = 'message';
+            let data = '';
+            raw.split('\n').forEach(line => {
+                if (line.startsWith('event: ')) event = line.slice(7);
+                else if (line.startsWith('data: ')) data += line.slice(6);
+            });
+            const payload = JSON.parse(data || '{}');
+            if (event === 'error') throw new Error(payload.error);
+            if (payload.text) {
+                text += payload.text;
+                onText(text);
+            }
+        }
+    }
+    return text.trim();
+}
+
+// Fill each field's popup from a batch /prefill reply
+function showPrefill(suggestions) {
+    Object.entries(suggestions || {}).forEach(([field, text]) => {
+        const popup = document.getElementById(field + '_popup');
+        if (!popup) return;
+        popup.style.display = 'block';
+        popup.innerText = text;
+    });
+}
+
 document.addEventListener('DOMContentLoaded', () => {
     // Add CSRF token function at the very beginning
     function getCSRFToken() {
@@ -91,27 +148,53 @@ document.addEventListener('DOMContentLoaded', () => {
             };
 
             try {
-                const res = await fetch(`/ai_suggestion/subjective/${field}`, {
+                const popup = document.getElementById(field + '_popup');
+                popup.style.display = 'block';
+                await streamSuggestion(`/ai_suggestion/subjective/${field}`, {
                     method: 'POST',
                     headers: {
                         'Content-Type': 'application/json',
                         'X-CSRFToken': getCSRFToken()
                     },
                     body: JSON.stringify(payload)
-                });
-
-                const { suggestion, error } = await res.json();
-                if (error) throw new Error(error);
-
-                const popup = document.getElementById(field + '_popup');
-                popup.innerText = suggestion;
-                popup.style.display = 'block';
+                }, text => { popup.innerText = text; });
             } catch (e) {
                 alert('Error: ' + e.message);
             }
         });
     });
 
+    // One round trip for every field's suggestions
+    document.getElementById('prefill_subjective')?.addEventListener('click', async () => {
+        const inputs = {};
+        document.querySelectorAll('.input-field')
+            .forEach(el => inputs[el.name] = el.value.trim());
+
+        const payload = {
+            age_sex: ageSexInput.value.trim(),
+            present_history: presentInput.value.trim(),
+            past_history: pastInput?.value.trim() || '',
+            inputs
+        };
+
+        try {
+            const res = await fetch('/ai_suggestion/subjective/prefill', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                    'X-CSRFToken': getCSRFToken()
+                },
+                body: JSON.stringify(payload)
+            });
+
+            const { suggestions, error } = await res.json();
+            if (error) throw new Error(error);
+            showPrefill(suggestions);
+        } catch (e) {
+            alert('Error: ' + e.message);
+        }
+    });
+
     genDxBtn?.addEventListener('click', async () => {
         const inputs = {};
         document.querySelectorAll('.input-field')
@@ -151,48 +234,54 @@ if (document.getElementById('perspectives-form')) {
             ?.split('=')[1];
     }
 
-    const prevAdd = JSON.parse(localStorage.getItem('add_patient_data') || '{}');
-    const prevSubj = JSON.parse(localStorage.getItem('subjective_inputs') || '{}');
-    let prevPersp = JSON.parse(localStorage.getItem('perspectives_inputs') || '{}');
-
-    const allPrev = {
-        age_sex: prevAdd.age_sex || '',
-        present_history: prevAdd.present_history || '',
-        past_history: prevAdd.past_history || '',
-        subjective: prevSubj,
-        perspectives: prevPersp
-    };
-
+    // The server assembles the saved-stage context from patient_id
     document.querySelectorAll('.ai-btn').forEach(btn => {
         btn.addEventListener('click', async () => {
             const field = btn.dataset.field;
             const value = document.getElementById(field).value.trim();
 
-            prevPersp[field] = value;
-            localStorage.setItem('perspectives_inputs', JSON.stringify(prevPersp));
-
             try {
-                const res = await fetch(`/ai_suggestion/perspectives/${field}`, {
+                const pop = document.getElementById(field + '_popup');
+                pop.style.display = 'block';
+                await streamSuggestion(`/ai_suggestion/perspectives/${field}`, {
                     method: 'POST',
                     headers: {
                         'Content-Type': 'application/json',
                         'X-CSRFToken': getCSRFToken()
                     },
-                    body: JSON.stringify({ previous: allPrev, inputs: { [field]: value } })
-                });
-
-                const { suggestion, error } = await res.json();
-                if (error) throw new Error(error);
-
-                const pop = document.getElementById(field + '_popup');
-                pop.innerText = suggestion;
-                pop.style.display = 'block';
+                    body: JSON.stringify({ patient_id: window.patientId, inputs: { [field]: value } })
+                }, text => { pop.innerText = text; });
             } catch (e) {
                 alert('Error: ' + e.message);
             }
         });
     });
 
+    document.getElementById('prefill_perspectives')?.addEventListener('click', async () => {
+        const inputs = {};
+        ['knowledge','attribution','expectation','consequences_awareness','locus_of_control','affective_aspect']
+            .forEach(name => {
+                inputs[name] = document.getElementById(name).value.trim();
+            });
+
+        try {
+            const res = await fetch('/ai_suggestion/perspectives/prefill', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                    'X-CSRFToken': getCSRFToken()
+                },
+                body: JSON.stringify({ patient_id: window.patientId, inputs })
+            });
+
+            const { suggestions, error } = await res.json();
+            if (error) throw new Error(error);
+            showPrefill(suggestions);
+        } catch (e) {
+            alert('Error: ' + e.message);
+        }
+    });
+
     document.getElementById('gen_perspectives_dx')?.addEventListener('click', async () => {
         const inputs = {};
         ['knowledge','attribution','expectation','consequences_awareness','locus_of_control','affective_aspect']
@@ -207,7 +296,7 @@ if (document.getElementById('perspectives-form')) {
                     'Content-Type': 'application/json',
                     'X-CSRFToken': getCSRFToken()
                 },
-                body: JSON.stringify({ previous: allPrev, inputs })
+                body: JSON.stringify({ patient_id: window.patientId, inputs })
             });
 
             const { suggestion, error } = await res.json();
@@ -227,20 +316,8 @@ if (document.getElementById('initial-plan-form')) {
             ?.split('=')[1];
     }
 
-    const prevAdd = JSON.parse(localStorage.getItem('add_patient_data') || '{}');
-    const prevSubj = JSON.parse(localStorage.getItem('subjective_inputs') || '{}');
-    const prevPersp = JSON.parse(localStorage.getItem('perspectives_inputs')|| '{}');
     let prevAssess = JSON.parse(localStorage.getItem('initial_plan_assessments') || '{}');
 
-    const allPrev = {
-        age_sex: prevAdd.age_sex || '',
-        present_history: prevAdd.present_history|| '',
-        past_history: prevAdd.past_history || '',
-        subjective: prevSubj,
-        perspectives: prevPersp,
-        assessments: prevAssess
-    };
-
     document.querySelectorAll('.ai-btn').forEach(btn => {
         btn.addEventListener('click', async () => {
             const field = btn.dataset.field;
@@ -250,18 +327,15 @@ if (document.getElementById('initial-plan-form')) {
             localStorage.setItem('initial_plan_assessments', JSON.stringify(prevAssess));
 
             try {
-                const res = await fetch(`/ai_suggestion/initial_plan/${field}`, {
+                const box = document.getElementById(field + '_suggestion');
+                await streamSuggestion(`/ai_suggestion/initial_plan/${field}`, {
                     method: 'POST',
                     headers: {
                         'Content-Type': 'application/json',
                         'X-CSRFToken': getCSRFToken()
                     },
-                    body: JSON.stringify({ previous: allPrev, selection })
-                });
-
-                const { suggestion, error } = await res.json();
-                if (error) throw new Error(error);
-                document.getElementById(field + '_suggestion').value = suggestion;
+                    body: JSON.stringify({ patient_id: window.patientId, selection })
+                }, text => { box.value = text; });
             } catch (err) {
                 alert('Error: ' + err.message);
             }
@@ -282,18 +356,17 @@ if (document.getElementById('initial-plan-form')) {
         localStorage.setItem('initial_plan_assessments', JSON.stringify(prevAssess));
 
         try {
-            const res = await fetch('/ai_suggestion/initial_plan_summary', {
+            const out = document.getElementById('initial_summary_output');
+            out.textContent = 'Thinking…';
+            out.style.display = 'block';
+            await streamSuggestion('/ai_suggestion/initial_plan_summary', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
                     'X-CSRFToken': getCSRFToken()
                 },
-                body: JSON.stringify({ previous: allPrev, assessments: prevAssess })
-            });
-
-            const { summary, error } = await res.json();
-            if (error) throw new Error(error);
-            alert("Assessment Summary & Provisional Dx:\n\n" + summary);
+                body: JSON.stringify({ patient_id: window.patientId, assessments: prevAssess })
+            }, text => { out.textContent = text; });
         } catch (e) {
             alert('Error: ' + e.message);
         }
@@ -308,41 +381,22 @@ if (document.querySelector('select#possible_source')) {
             ?.split('=')[1];
     }
 
-    const prevAdd = JSON.parse(localStorage.getItem('add_patient_data') || '{}');
-    const prevSubj = JSON.parse(localStorage.getItem('subjective_inputs') || '{}');
-    const prevPersp = JSON.parse(localStorage.getItem('perspectives_inputs')|| '{}');
-    const assessments = JSON.parse(localStorage.getItem('initial_plan_assessments')|| '{}');
-
-    const allPrev = {
-        age_sex: prevAdd.age_sex||'',
-        present_history: prevAdd.present_history||'',
-        past_history: prevAdd.past_history||'',
-        subjective: prevSubj,
-        perspectives: prevPersp,
-        assessments: assessments
-    };
-
     document.querySelectorAll('.ai-btn').forEach(btn => {
         btn.addEventListener('click', async () => {
             const field = btn.dataset.field;
             const selection = document.getElementById(field).value.trim();
 
             try {
-                const res = await fetch('/ai_suggestion/patho/possible_source', {
+                const pop = document.getElementById(field + '_popup');
+                pop.style.display = 'block';
+                await streamSuggestion('/ai_suggestion/patho/possible_source', {
                     method: 'POST',
                     headers: {
                         'Content-Type': 'application/json',
                         'X-CSRFToken': getCSRFToken()
                     },
-                    body: JSON.stringify({ previous: allPrev, selection })
-                });
-
-                const { suggestion, error } = await res.json();
-                if (error) throw new Error(error);
-
-                const pop = document.getElementById(field + '_popup');
-                pop.innerText = suggestion;
-                pop.style.display = 'block';
+                    body: JSON.stringify({ patient_id: window.patientId, selection })
+                }, text => { pop.innerText = text; });
             } catch (e) {
                 alert('Error: ' + e.message);
             }
@@ -358,20 +412,6 @@ if (document.getElementById('specific_factors')) {
             ?.split('=')[1];
     }
 
-    const prevAdd = JSON.parse(localStorage.getItem('add_patient_data') || '{}');
-    const prevSubj = JSON.parse(localStorage.getItem('subjective_inputs') || '{}');
-    const prevPersp = JSON.parse(localStorage.getItem('perspectives_inputs')|| '{}');
-    const assessments = JSON.parse(localStorage.getItem('initial_plan_assessments')|| '{}');
-
-    const allPrev = {
-        age_sex: prevAdd.age_sex||'',
-        present_history: prevAdd.present_history||'',
-        past_history: prevAdd.past_history||'',
-        subjective: prevSubj,
-        perspectives: prevPersp,
-        assessments
-    };
-
     document.querySelector('.ai-btn').addEventListener('click', async e => {
         const btn = e.currentTarget;
         const field = btn.dataset.field;
@@ -381,25 +421,20 @@ if (document.getElementById('specific_factors')) {
             .map(cb => cb.value);
 
         try {
-            const res = await fetch('/ai_suggestion/chronic/specific_factors', {
+            const pop = document.getElementById(field + '_popup');
+            pop.style.display = 'block';
+            await streamSuggestion('/ai_suggestion/chronic/specific_factors', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
                     'X-CSRFToken': getCSRFToken()
                 },
                 body: JSON.stringify({
-                    previous: allPrev,
+                    patient_id: window.patientId,
                     input: text,
                     causes
                 })
-            });
-
-            const { suggestion, error } = await res.json();
-            if (error) throw new Error(error);
-
-            const pop = document.getElementById(field + '_popup');
-            pop.innerText = suggestion;
-            pop.style.display = 'block';
+            }, suggestion => { pop.innerText = suggestion; });
         } catch (err) {
             alert('Error: ' + err.message);
         }
@@ -454,7 +489,7 @@ if (document.getElementById('clinical-flags-form')) {
                             'Content-Type': 'application/json',
                             'X-CSRFToken': getCSRFToken()
                         },
-                        body: JSON.stringify({ previous: allPrev, field, text })
+                        body: JSON.stringify({ field, text })
                     }
                 );
 
@@ -515,7 +550,7 @@ if (document.getElementById('objective-assessment-form')) {
                             'Content-Type': 'application/json',
                             'X-CSRFToken': getCSRFToken()
                         },
-                        body: JSON.stringify({ previous: allPrev, value: allPrev.assessments[field].choice })
+                        body: JSON.stringify({ patient_id: window.patientId, value: allPrev.assessments[field].choice })
                     }
                 );
 
@@ -619,10 +654,6 @@ document.querySelectorAll('.ai-btn[data-screen="smart_goals"]').forEach(btn => {
                 },
                 body: JSON.stringify({
                     patient_id: window.patientId,
-                    previous: JSON.parse(localStorage.getItem('add_patient_data') || '{}'),
-                    previous_subjective: JSON.parse(localStorage.getItem('subjective_inputs') || '{}'),
-                    previous_perspectives: JSON.parse(localStorage.getItem('perspectives_inputs') || '{}'),
-                    previous_assessments: JSON.parse(localStorage.getItem('initial_plan_inputs') || '{}'),
                     input
                 })
             });
@@ -651,7 +682,7 @@ document.querySelectorAll('.ai-btn').forEach(btn => {
         popup.style.display = 'block';
 
         try {
-            const resp = await fetch(
+            const suggestion = await streamSuggestion(
                 `/ai_suggestion/treatment_plan/${field}`,
                 {
                     method: 'POST',
@@ -663,13 +694,12 @@ document.querySelectorAll('.ai-btn').forEach(btn => {
                         patient_id: window.patientId,
                         input: document.getElementById(field).value
                     })
-                }
+                },
+                text => { popup.textContent = text; }
             );
-
-            const data = await resp.json();
-            popup.textContent = data.suggestion || data.error || 'No suggestion';
+            popup.textContent = suggestion || 'No suggestion';
         } catch (err) {
-            popup.textContent = 'Error fetching suggestion';
+            popup.textContent = err.message || 'Error fetching suggestion';
             console.error(err);
         }
     });
@@ -684,15 +714,18 @@ document.addEventListener('click', e => {
 const genBtn = document.getElementById('gen_summary');
 if (genBtn) {
     genBtn.addEventListener('click', async () => {
+        const out = document.getElementById('summary_output');
+        out.textContent = 'Thinking…';
+        out.style.display = 'block';
         try {
-            const resp = await fetch(
-                `/ai_suggestion/treatment_plan_summary/${window.patientId}`
+            await streamSuggestion(
+                `/ai_suggestion/treatment_plan_summary/${window.patientId}`,
+                {},
+                text => { out.textContent = text; }
             );
-            const data = await resp.json();
-            alert("Treatment Summary:\n\n" + (data.summary || data.error));
         } catch (err) {
             console.error(err);
-            alert('Error generating summary');
+            out.textContent = 'Error generating summary: ' + err.message;
         }
     });
 }
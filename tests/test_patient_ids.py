@@ -0,0 +1,189 @@
+"""
+Concurrency tests for PatientIdAllocator.
+
+The in-memory tests run the real ``firestore.transactional`` retry loop
+against a fake client that aborts a commit when a document it read has
+changed since, as Firestore does. The emulator test checks the same
+guarantee against real transactions and is skipped unless
+FIRESTORE_EMULATOR_HOST is set:
+
+    firebase emulators:start --only firestore
+    FIRESTORE_EMULATOR_HOST=127.0.0.1:8080 python -m pytest tests/test_patient_ids.py
+"""
+import os
+import sys
+import uuid
+import threading
+import unittest
+import itertools
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+WORKERS = 8
+IDS_PER_WORKER = 25
+BLOCK_SIZE = 3
+
+
+class FakeFirestore:
+    """
+    Just enough of the Firestore client for PatientIdAllocator: documents
+    with versions, and optimistic transactions whose commit raises Aborted
+    if a document read in the transaction was written by someone else first.
+    With ``hold_first_reads`` set, that many transactional reads wait for
+    each other, so every one of those transactions but one must retry.
+    """
+
+    def __init__(self, hold_first_reads=0):
+        self.docs = {}
+        self.lock = threading.Lock()
+        self.aborts = 0
+        self.commits = 0
+        self._barrier = threading.Barrier(hold_first_reads) if hold_first_reads else None
+        self._held = itertools.count()
+        self._ids = itertools.count(1)
+        self.hold_first_reads = hold_first_reads
+
+    def collection(self, name):
+        return FakeCollection(self, name)
+
+    def transaction(self, max_attempts=5):
+        return FakeTransaction(self, max_attempts)
+
+
+class FakeCollection:
+    def __init__(self, db, name):
+        self.db = db
+        self.name = name
+
+    def document(self, key):
+        return FakeDocRef(self.db, f"{self.name}/{key}")
+
+
+class FakeSnapshot:
+    def __init__(self, data):
+        self._data = data
+        self.exists = data is not None
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+
+class FakeDocRef:
+    def __init__(self, db, path):
+        self.db = db
+        self.path = path
+
+    def get(self, transaction=None):
+        with self.db.lock:
+            data, version = self.db.docs.get(self.path, (None, 0))
+        if transaction is not None:
+            transaction.reads[self.path] = version
+            if self.db._barrier and next(self.db._held) < self.db.hold_first_reads:
+                self.db._barrier.wait(timeout=10)
+        return FakeSnapshot(data)
+
+
+class FakeTransaction:
+    _read_only = False
+
+    def __init__(self, db, max_attempts):
+        self.db = db
+        self._max_attempts = max_attempts
+        self._id = None
+        self._clean_up()
+
+    def _clean_up(self):
+        self.reads = {}
+        self.writes = []
+        self._id = None
+
+    def _begin(self, retry_id=None):
+        self._id = f"txn-{next(self.db._ids)}".encode()
+
+    def _rollback(self):
+        self._clean_up()
+
+    def set(self, ref, data, merge=False):
+        self.writes.append((ref.path, data, merge))
+
+    def _commit(self):
+        from google.api_core.exceptions import Aborted
+
+        with self.db.lock:
+            for path, version in self.reads.items():
+                if self.db.docs.get(path, (None, 0))[1] != version:
+                    self.db.aborts += 1
+                    self._clean_up()
+                    raise Aborted('document changed since it was read')
+            for path, data, merge in self.writes:
+                current, version = self.db.docs.get(path, ({}, 0))
+                self.db.docs[path] = ({**current, **data} if merge else dict(data), version + 1)
+            self.db.commits += 1
+        self._clean_up()
+        return []
+
+
+def allocate_concurrently(make_db, collection, now, workers=WORKERS, per_worker=IDS_PER_WORKER):
+    from patient_ids import PatientIdAllocator
+
+    def worker(_):
+        allocator = PatientIdAllocator(make_db(), block_size=BLOCK_SIZE, collection=collection)
+        return [allocator.allocate(now) for _ in range(per_worker)]
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return [pid for batch in pool.map(worker, range(workers)) for pid in batch]
+
+
+class PatientIdAllocatorTransactionTest(unittest.TestCase):
+    """Block reservation and Aborted retries, without the emulator."""
+
+    def test_conflicting_reservations_retry_and_never_repeat_an_id(self):
+        # every allocator reads the empty counter before anyone commits
+        db = FakeFirestore(hold_first_reads=WORKERS)
+        ids = allocate_concurrently(lambda: db, 'patient_counters', datetime(2025, 7, 15))
+
+        self.assertEqual(len(set(ids)), WORKERS * IDS_PER_WORKER, 'duplicate patient IDs allocated')
+        self.assertGreaterEqual(db.aborts, WORKERS - 1, 'the retry path was not exercised')
+
+        # each allocator reserved whole blocks, and each block was counted once
+        blocks_each = -(-IDS_PER_WORKER // BLOCK_SIZE)
+        count = db.docs['patient_counters/202507'][0]['count']
+        self.assertEqual(count, WORKERS * blocks_each * BLOCK_SIZE)
+        self.assertEqual(db.commits, WORKERS * blocks_each)
+        self.assertTrue(all(1 <= int(pid.rsplit('/', 1)[1]) <= count for pid in ids))
+
+    def test_new_month_starts_a_new_counter(self):
+        from patient_ids import PatientIdAllocator
+
+        allocator = PatientIdAllocator(FakeFirestore(), block_size=BLOCK_SIZE)
+        july = [allocator.allocate(datetime(2025, 7, 31)) for _ in range(2)]
+        august = allocator.allocate(datetime(2025, 8, 1))
+        self.assertEqual(july, ['2025/07/01', '2025/07/02'])
+        self.assertEqual(august, '2025/08/01')
+
+
+@unittest.skipUnless(os.environ.get('FIRESTORE_EMULATOR_HOST'), 'needs the Firestore emulator')
+class PatientIdAllocatorConcurrencyTest(unittest.TestCase):
+
+    def test_concurrent_allocators_never_repeat_an_id(self):
+        from google.cloud import firestore
+
+        # a fresh counter collection per run, so reruns start from zero
+        collection = f"patient_counters_test_{uuid.uuid4().hex[:8]}"
+        # one client and allocator per thread, like separate gunicorn workers
+        ids = allocate_concurrently(lambda: firestore.Client(project='demo-physio'),
+                                    collection, datetime(2025, 7, 15))
+
+        self.assertEqual(len(ids), WORKERS * IDS_PER_WORKER)
+        self.assertEqual(len(set(ids)), len(ids), 'duplicate patient IDs allocated')
+        self.assertTrue(all(pid.startswith('2025/07/') for pid in ids))
+
+        # every reserved block was counted once
+        counter = firestore.Client(project='demo-physio').collection(collection).document('202507').get()
+        self.assertGreaterEqual(counter.to_dict()['count'], len(ids))
+
+
+if __name__ == '__main__':
+    unittest.main()